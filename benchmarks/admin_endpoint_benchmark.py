@@ -0,0 +1,88 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Benchmark of the throughput of an admin endpoint, which validates the server password on every call.
+Compares the previous validation, which read the stored hash from its file on every call, against the cached
+hashes of the security module, both for the whole endpoint and for the validation alone.
+
+Usage: python benchmarks/admin_endpoint_benchmark.py [call count]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import synthetic_models  # noqa: adds the service folder to the python path
+import request_broker as rb
+import security
+
+
+def _uncached_password_is_valid(password):
+    password_hash = hashlib.sha512(password).hexdigest()
+    with open(os.path.join('resources', 'server-secret-hash.txt'), 'r') as hash_file:
+        correct_hash = hash_file.read()
+    return password_hash == correct_hash
+
+
+def _measure_validation(password_is_valid, password, call_count):
+    start = time.time()
+    for _ in range(call_count):
+        assert password_is_valid(password)
+    return call_count / (time.time() - start)
+
+
+def _measure(client, password, call_count):
+    data = json.dumps({'password': password})
+    start = time.time()
+    for _ in range(call_count):
+        response = client.post('/snape/1.0/cache/models', data = data, content_type = 'application/json')
+        assert response.status_code == 200
+    return call_count / (time.time() - start)
+
+
+def main(argv):
+    call_count = int(argv[0]) if argv else 5000
+    os.chdir(synthetic_models.SERVICE_PATH)
+    with open(os.path.join('resources', 'server-secret.txt'), 'r') as secret_file:
+        password = secret_file.read()
+    client = rb.app.test_client()
+
+    rb.server_password_is_valid = _uncached_password_is_valid
+    uncached = _measure(client, password, call_count)
+    rb.server_password_is_valid = security.server_password_is_valid
+    cached = _measure(client, password, call_count)
+
+    uncached_validation = _measure_validation(_uncached_password_is_valid, password, call_count * 10)
+    cached_validation = _measure_validation(security.server_password_is_valid, password, call_count * 10)
+
+    print '%i calls of POST /snape/1.0/cache/models' % call_count
+    print 'hash read per call: %9.0f calls/s' % uncached
+    print 'cached hash:        %9.0f calls/s (%.2fx)' % (cached, cached / uncached)
+    print '%i password validations' % (call_count * 10)
+    print 'hash read per call: %9.0f calls/s' % uncached_validation
+    print 'cached hash:        %9.0f calls/s (%.2fx)' % (cached_validation, cached_validation / uncached_validation)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Micro-benchmark of the change detection between two consecutive timeslices. Compares the previous linear
+scan with field-by-field comparison against the obj_id index with fingerprint comparison of the diff_analyzer.
+
+Usage: python benchmarks/change_detection_benchmark.py [node count]
+"""
+
+import sys
+import time
+
+import synthetic_models  # noqa: adds the service folder to the python path
+from drawables import UMLClass, UMLAssociation
+import diff_analyzer as anal
+
+CLASS_COMPARISONS = [('name', 'Name'), ('methods', 'Methods'), ('attributes', 'Attributes')]
+ASSOCIATION_COMPARISONS = [('name', 'Name'), ('from_id', 'Tail'), ('to_id', 'Head'), ('directed', 'Directedness'),
+                           ('aggregation', 'Aggregatedness')]
+
+
+def _make_timeslice(node_count, revision):
+    timeslice = list()
+    for n in range(node_count):
+        name = 'Class%i' % n if n % 50 else 'Class%i_r%i' % (n, revision)
+        timeslice.append(UMLClass(obj_id = 'class_view_%i' % n, name = name,
+                                  methods = ['+op%i()' % m for m in range(n % 3)],
+                                  attributes = ['+attr%i: int' % a for a in range(n % 4)]))
+    for n in range(1, node_count):
+        timeslice.append(UMLAssociation(obj_id = 'association_view_%i' % n, from_id = 'class_view_%i' % n,
+                                        to_id = 'class_view_%i' % (n // 2), name = 'assoc%i' % n,
+                                        multiplicities = ('1', '0..*'), directed = n % 2 == 0))
+    return timeslice
+
+
+def _linear_detection(prev_timeslice, timeslice):
+    def contains_class(obj_id):
+        for objct in prev_timeslice:
+            if objct.obj_id == obj_id:
+                return objct
+        return None
+
+    all_changes = list()
+    for drawable in timeslice:
+        comparisons = CLASS_COMPARISONS if isinstance(drawable, UMLClass) else ASSOCIATION_COMPARISONS
+        obj = contains_class(drawable.obj_id)
+        if obj:
+            all_changes.append([description for attribute, description in comparisons
+                                if getattr(obj, attribute) != getattr(drawable, attribute)])
+        else:
+            all_changes.append(['Created'])
+    return all_changes
+
+
+def _indexed_detection(prev_timeslice, timeslice):
+    prev_index = anal._index_timeslice(prev_timeslice)
+    all_changes = list()
+    for drawable in timeslice:
+        comparisons = CLASS_COMPARISONS if isinstance(drawable, UMLClass) else ASSOCIATION_COMPARISONS
+        all_changes.append(anal._detect_changes(prev_index, drawable, comparisons))
+    return all_changes
+
+
+def _measure(detection, prev_timeslice, node_count, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        timeslice = _make_timeslice(node_count, revision = 2)
+        start = time.time()
+        result = detection(prev_timeslice, timeslice)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv):
+    node_count = int(argv[0]) if argv else 5000
+    prev_timeslice = _make_timeslice(node_count, revision = 1)
+    for drawable in prev_timeslice:
+        drawable.fingerprint()  # computed while the previous revision was processed
+
+    linear, linear_changes = _measure(_linear_detection, prev_timeslice, node_count, repeat = 1)
+    indexed, indexed_changes = _measure(_indexed_detection, prev_timeslice, node_count, repeat = 5)
+    assert linear_changes == indexed_changes
+
+    print '%i nodes, %i drawables per timeslice, %i changed' % \
+          (node_count, len(prev_timeslice), sum(1 for changes in indexed_changes if changes))
+    print 'linear scan:           %9.4f s' % linear
+    print 'index and fingerprint: %9.4f s (%.0fx)' % (indexed, linear / indexed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Measures the disk savings of revisions stored as deltas and the overhead of reconstructing them while parsing all revisions of a project.
+
+Usage: python benchmarks/delta_storage_benchmark.py [class counts...]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from synthetic_models import write_models
+import model_parser as parser
+import revision_storage as storage
+
+REVISIONS = 10
+SNAPSHOT_INTERVAL = 5
+REPEAT = 3
+
+
+def _measure_parse(mdj_files):
+    def parse():
+        parser._model_cache.clear()
+        getattr(storage, '__flat_cache').clear()
+        parser.parse_models(mdj_files)
+    return min(timeit.repeat(parse, number = 1, repeat = REPEAT))
+
+
+def main(argv):
+    class_counts = [int(arg) for arg in argv] or [100, 500, 1000]
+    parser._model_cache.persist = False
+    storage.DELTA_SNAPSHOT_INTERVAL = SNAPSHOT_INTERVAL
+    print '%10s %14s %14s %7s %14s %14s %9s' % ('classes', 'plain [B]', 'delta [B]', 'ratio',
+                                                'plain [s]', 'delta [s]', 'overhead')
+    for class_count in class_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            plain_files = write_models(os.path.join(directory, 'plain'), class_count, REVISIONS)
+            shutil.copytree(os.path.join(directory, 'plain'), os.path.join(directory, 'delta'))
+            delta_files = [path.replace('plain', 'delta', 1) for path in plain_files]
+            for n in range(1, len(delta_files)):
+                delta_files[n] = storage.encode_delta(delta_files[n], delta_files[n - 1])
+            plain_size = sum(os.path.getsize(path) for path in plain_files)
+            delta_size = sum(os.path.getsize(path) for path in delta_files)
+
+            plain = _measure_parse(plain_files)
+            delta = _measure_parse(delta_files)
+        finally:
+            shutil.rmtree(directory)
+        print '%10i %14i %14i %6.1fx %14.4f %14.4f %8.1f%%' % (class_count, plain_size, delta_size,
+                                                               float(plain_size) / delta_size, plain, delta,
+                                                               (delta / plain - 1) * 100)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
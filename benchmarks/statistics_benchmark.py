@@ -0,0 +1,72 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Measures the computation of the node and edge data of the latest revision for the project statistics,
+from the frame of its timeslice, against the .dot definitions of the history the statistics were counted
+in before. The gc and gvpr calls that used to follow on the .dot definitions are not included.
+
+Usage: python benchmarks/statistics_benchmark.py [revision counts...]
+"""
+
+import shutil
+import sys
+import tempfile
+import timeit
+
+from synthetic_models import write_models
+import model_parser as parser
+import diff_analyzer as anal
+import graph_animator as anim
+import statistic_collector as collector
+
+CLASSES = 200
+REPEAT = 3
+
+
+def _measure(function):
+    return min(timeit.repeat(function, number = 1, repeat = REPEAT))
+
+
+def main(argv):
+    revision_counts = [int(arg) for arg in argv] or [5, 10, 20, 40]
+    print '%10s %14s %14s %9s' % ('revisions', '.dot [s]', 'frame [s]', 'speedup')
+    for revision_count in revision_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            parsed = parser.parse_models(write_models(directory, CLASSES, revision_count))
+            timeslice_array, error_flag = anal.get_timeslices(parsed = parsed, diagram_id = 'all')
+
+            dot = _measure(lambda: anim.render_timeslices(timeslice_array = timeslice_array,
+                                                          disable_rendering = True))
+
+            def collect_frame():
+                nodes, edges = anim.get_frame_graph(timeslice_array[-1])
+                collector._collect_quantity_stats(nodes, edges, dict())
+                collector._collect_connectivity_stats(parsed, nodes, edges, dict())
+            frame = _measure(collect_frame)
+        finally:
+            shutil.rmtree(directory)
+        print '%10i %14.4f %14.4f %8.1fx' % (revision_count, dot, frame, dot / frame)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
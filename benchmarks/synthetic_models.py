@@ -0,0 +1,124 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Generators for synthetic StarUML models, used by the benchmarks in this folder.
+"""
+
+import json
+import os
+import sys
+
+SERVICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'service')
+if SERVICE_PATH not in sys.path:
+    sys.path.insert(0, SERVICE_PATH)
+
+
+def _class(n, revision):
+    return {
+        '_type': 'UMLClass',
+        '_id': 'class_%i' % n,
+        'name': 'Class%i' % n if n % 50 or not revision else 'Class%i_r%i' % (n, revision),
+        'ownedElements': []
+    }
+
+
+def _class_view(n, revision):
+    return {
+        '_type': 'UMLClassView',
+        '_id': 'class_view_%i' % n,
+        'model': {'$ref': 'class_%i' % n},
+        'subViews': [
+            {'_type': 'UMLNameCompartmentView', '_id': 'name_view_%i' % n, 'nameLabel': {'$ref': 'label_%i' % n},
+             'subViews': [{'_type': 'LabelView', '_id': 'label_%i' % n, 'text': 'Class%i' % n}]},
+            {'_type': 'UMLAttributeCompartmentView', '_id': 'attribute_view_%i' % n,
+             'subViews': [{'_type': 'UMLAttributeView', '_id': 'attribute_%i_%i' % (n, a), 'text': '+attr%i: int' % a}
+                          for a in range(n % 4)]},
+            {'_type': 'UMLOperationCompartmentView', '_id': 'operation_view_%i' % n,
+             'subViews': [{'_type': 'UMLOperationView', '_id': 'operation_%i_%i' % (n, o), 'text': '+op%i()' % o}
+                          for o in range(n % 3 + revision % 2)]}
+        ]
+    }
+
+
+def _association(n):
+    return {
+        '_type': 'UMLAssociation',
+        '_id': 'association_%i' % n,
+        'name': 'assoc%i' % n,
+        'end1': {'navigable': n % 2 == 0, 'multiplicity': '1'},
+        'end2': {'multiplicity': '0..*', 'aggregation': 'shared' if n % 7 == 0 else False}
+    }
+
+
+def _association_view(n):
+    return {
+        '_type': 'UMLAssociationView',
+        '_id': 'association_view_%i' % n,
+        'model': {'$ref': 'association_%i' % n},
+        'head': {'$ref': 'class_view_%i' % (n // 2)},
+        'tail': {'$ref': 'class_view_%i' % n}
+    }
+
+
+def make_model(class_count, revision = 0):
+    """
+    Synopsis:
+        Creates a decoded .mdj model containing one class diagram with the given number of classes.
+        Every class except the first one is connected to another class by an association.
+        Varying the revision renames some classes and changes some operation compartments.
+    :param class_count: number of classes in the diagram
+    :param revision: revision number used to vary the model
+    :returns model: dictionary that can be dumped as .mdj file
+    """
+    classes = [_class(n, revision) for n in range(class_count)]
+    views = [_class_view(n, revision) for n in range(class_count)]
+    for n in range(1, class_count):
+        classes[n]['ownedElements'].append(_association(n))
+        views.append(_association_view(n))
+
+    diagram = {'_type': 'UMLClassDiagram', '_id': 'diagram_1', 'name': 'Main', 'ownedViews': views}
+    return {
+        '_type': 'Project',
+        '_id': 'project',
+        'name': 'Synthetic',
+        'ownedElements': [{'_type': 'UMLModel', '_id': 'model', 'name': 'Model',
+                           'ownedElements': [diagram] + classes}]
+    }
+
+
+def write_models(directory, class_count, revisions):
+    """
+    Synopsis:
+        Writes a sequence of synthetic revisions into the given directory, one folder per revision.
+    :param directory: target directory
+    :param class_count: number of classes per revision
+    :param revisions: number of revisions
+    :returns mdj_files: list of paths to the written .mdj files
+    """
+    mdj_files = list()
+    for revision in range(1, revisions + 1):
+        os.makedirs(os.path.join(directory, 'v%i' % revision))
+        path = os.path.join(directory, 'v%i' % revision, 'model.mdj')
+        with open(path, 'w') as mdj_file:
+            json.dump(make_model(class_count, revision), mdj_file)
+        mdj_files.append(path)
+    return mdj_files
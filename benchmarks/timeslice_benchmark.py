@@ -0,0 +1,69 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Measures get_timeslices against the size of the model, with and without the obj_id index that the
+model_parser attaches to the roots of parse trees.
+
+Usage: python benchmarks/timeslice_benchmark.py [class counts...]
+"""
+
+import shutil
+import sys
+import tempfile
+import timeit
+
+from synthetic_models import write_models
+import model_parser as parser
+import diff_analyzer as anal
+
+REVISIONS = 2
+REPEAT = 3
+
+
+def _measure(parsed):
+    return min(timeit.repeat(lambda: anal.get_timeslices(parsed = parsed, diagram_id = 'diagram_1'),
+                             number = 1, repeat = REPEAT))
+
+
+def main(argv):
+    class_counts = [int(arg) for arg in argv] or [100, 250, 500, 750]
+    print '%10s %10s %14s %14s %9s' % ('classes', 'elements', 'walk [s]', 'index [s]', 'speedup')
+    for class_count in class_counts:
+        directory = tempfile.mkdtemp()
+        try:
+            parsed = parser.parse_models(write_models(directory, class_count, REVISIONS))
+            element_count = len(parsed[-1].index)
+
+            indexed = _measure(parsed)
+            indices = [tree.index for tree in parsed]
+            for tree in parsed:
+                tree.index = None
+            walked = _measure(parsed)
+            for tree, index in zip(parsed, indices):
+                tree.index = index
+        finally:
+            shutil.rmtree(directory)
+        print '%10i %10i %14.4f %14.4f %8.1fx' % (class_count, element_count, walked, indexed, walked / indexed)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
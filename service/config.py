@@ -29,3 +29,13 @@ USE_SSL = False                 # if true a valid SSL certificate is required
 CRT_PATH = r'~/example/path'    # Certificate path. Necessary if USE_SSL is True
 KEY_PATH = r'~/example/path'    # Certificate path. Necessary if USE_SSL is True
 TOKEN_MAX_REQUEST = 1000        # max number of tokens requestable in one request
+PARSE_CACHE_MAX_BYTES = 5e8     # budget of the parsed model cache, measured in bytes of the cached .mdj files
+PARSE_CACHE_PERSIST = True      # if true parsed models are additionally stored next to their revision on disk
+LAZY_RENDERING = True           # if true get_history renders the requested frame first and the remaining frames in the background
+LOCK_WAIT_LOG_THRESHOLD = 0.1   # waits for database locks of at least this many seconds are logged
+UPLOAD_CHUNK_SIZE = 1 << 16     # bytes of an uploaded model file that are held in memory at once while it is stored
+COMPRESS_REVISIONS = False      # if true new revisions are stored gzip-compressed, see revision_storage.py
+DELTA_SNAPSHOT_INTERVAL = 0     # if > 0 revisions are stored as deltas to their predecessor, with a complete revision every n revisions
+SKIP_UNCHANGED_UPLOADS = False  # if true an upload identical to the latest revision is acknowledged without adding a revision
+STATISTICS_WORKERS = 2          # max number of threads that regenerate project statistics in the background
+PRERENDER_HISTORIES = False     # if true the histories of changed diagrams are rendered into the cache after the statistics
@@ -29,10 +29,14 @@ def find_tree_elem_by_id(obj_tree, obj_id):
     Synopsis:
         Searches the given object tree for an object with the given ID, and returns it.
         If no object is found, None is returned instead.
+        Roots of parse trees carry an index built by the model_parser, which is used for constant time lookups.
+        All other subtrees are searched recursively.
     :param obj_tree: root of the object tree to be searched
     :param obj_id: ID of the object to be searched for
     :returns obj: found object or None
     """
+    if obj_tree.index is not None:
+        return obj_tree.index.get(obj_id)
     if obj_tree.obj_id == obj_id:
         return obj_tree
     else:
@@ -66,270 +70,327 @@ def get_diagram_names_and_ids(parsed):
     return diagram_list
 
 
-def get_timeslices(parsed, diagram_id):
+def _index_timeslice(timeslice):
     """
     Synopsis:
-        Takes a list of parsed .mdj files and turns them into a list of timeslices.
-        (i.e. a list of lists of Drawable objects as specified in drawable.py)
-    :param parsed: list or parsed .mdj-files
-    :param diagram_id: ID of the diagram to be rendered
-    :returns timeslice_array: list of timeslices
-    :returns error_flag: indicator that an error occurrec during execution
+        Builds an obj_id -> Drawable dictionary of a timeslice. If IDs are ambiguous, the first Drawable wins.
+    :param timeslice: list of Drawables
+    :returns index: dictionary
     """
-    global timeslice_array
-    timeslice_array = list()
-    error_flag = False
+    index = dict()
+    for drawable in timeslice:
+        index.setdefault(drawable.obj_id, drawable)
+    return index
 
-    try:
-        def contains_class(prev_timeslice, obj_id):
-            for objct in prev_timeslice:
-                if objct.obj_id == obj_id:
-                    return objct
-            return None
-
-        def traverse_tree(node, root, diagram_id, timeslice):
-            """
-            Synopsis:
-                Recursively traverses a parsed tree and transforms nodes into Drawable objects.
-            :param node: current node during traversal
-            :param root: parse tree top level node
-            :param diagram_id: ID of the diagram to be rendered
-            :param timeslice: current timeslice to which the Drawables are added
-            :returns timeslice: current timeslice
-            """
-            global timeslice_array
-
-            skip_node = False
-            diagram = node
-
-            if diagram_id != 'all' and node.obj_id.replace('/', '') != diagram_id:
-                skip_node = True
-
-            for view in diagram.owned_views:
-                if skip_node:
-                    break
-                if view.type == 'UMLClassView':
-
-                    class_model = find_tree_elem_by_id(root, view.model)
-
-                    attributes = []
-                    attribute_view = view.get_subview(view_type = 'UMLAttributeCompartmentView')
-                    for attr in attribute_view.subviews:
-                        if attr.type == 'UMLAttributeView':
-                            attributes.append(attr.text)
-
-                    methods = []
-                    method_view = view.get_subview(view_type = 'UMLOperationCompartmentView')
-                    for op in method_view.subviews:
-                        if op.type == 'UMLOperationView':
-                            methods.append(op.text)
-
-                    new_class = UMLClass(obj_id = view.obj_id,
-                                         name = class_model.name,
-                                         methods = methods,
-                                         attributes = attributes,
-                                         stereotype = class_model.stereotype)
-
-                    changes = []
-
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_class.obj_id)
-
-                        if obj:
-                            if obj.name != new_class.name:
-                                changes.append('Name')
-                            if obj.methods != new_class.methods:
-                                changes.append('Methods')
-                            if obj.attributes != new_class.attributes:
-                                changes.append('Attributes')
-                        else:
-                            changes.append('Created')
-
-                    new_class.has_changed(changes)
-
-                    timeslice.append(new_class)
-
-                elif view.type == 'UMLInterfaceView':
-
-                    name_view = view.get_subview(view_type = 'UMLNameCompartmentView')
-                    name_subview = name_view.get_subview(view_type = 'LabelView',
-                                                         view_id = name_view.name_label)
-
-                    new_interface = UMLInterface(obj_id = view.obj_id,
-                                                 name = name_subview.text)
-
-                    changes = []
-
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_interface.obj_id)
-
-                        if obj:
-                            if obj.name != new_interface.name:
-                                changes.append('Name')
-                        else:
-                            changes.append('Created')
-
-                    new_interface.has_changed(changes)
-
-                    timeslice.append(new_interface)
-
-                elif view.type in ['UMLAssociationView', 'UMLDependencyView', 'UMLGeneralizationView',
-                                   'UMLInterfaceRealizationView']:
-
-                    association = find_tree_elem_by_id(root, view.model)
-
-                    new_association = UMLAssociation(obj_id = view.obj_id,
-                                                     from_id = view.tail,
-                                                     to_id = view.head,
-                                                     name = association.name,
-                                                     directed = not association.navigable_end1,
-                                                     aggregation = association.aggregation2,
-                                                     multiplicities = (association.multiplicity1,
-                                                                       association.multiplicity2),
-                                                     dependency = view.type == 'UMLDependencyView',
-                                                     generalization = view.type == 'UMLGeneralizationView',
-                                                     realization = view.type == 'UMLInterfaceRealizationView')
-
-                    changes = []
 
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_association.obj_id)
+def _detect_changes(prev_index, drawable, comparisons):
+    """
+    Synopsis:
+        Compares a Drawable to its counterpart in the previous timeslice. If the fingerprints of both are equal,
+        nothing has changed. Otherwise the given attributes are compared one by one.
+    :param prev_index: obj_id index of the previous timeslice or None, if there is no previous timeslice
+    :param drawable: Drawable of the current timeslice
+    :param comparisons: list of (attribute name, change description) pairs
+    :returns changes: list of change descriptions
+    """
+    if prev_index is None:
+        return []
+    obj = prev_index.get(drawable.obj_id)
+    if obj is None:
+        return ['Created']
+    if obj.fingerprint() == drawable.fingerprint():
+        return []
+    return [description for attribute, description in comparisons
+            if getattr(obj, attribute) != getattr(drawable, attribute)]
+
+
+def _draw_views(diagram, root, prev_index):
+    """
+    Synopsis:
+        Transforms the views owned by a diagram node into Drawable objects.
+        Changes are detected against the given index of the previous timeslice.
+    :param diagram: diagram node whose views are transformed
+    :param root: parse tree top level node
+    :param prev_index: obj_id index of the previous timeslice or None, if this is the first revision
+    :returns timeslice: list of Drawables
+    """
+    timeslice = list()
+    for view in diagram.owned_views:
+        if view.type == 'UMLClassView':
+
+            class_model = find_tree_elem_by_id(root, view.model)
 
-                        if obj:
-                            if obj.name != new_association.name:
-                                changes.append('Name')
-                            if obj.from_id != new_association.from_id:
-                                changes.append('Tail')
-                            if obj.to_id != new_association.to_id:
-                                changes.append('Head')
-                            if obj.directed != new_association.directed:
-                                changes.append('Directedness')
-                            if obj.aggregation != new_association.aggregation:
-                                changes.append('Aggregatedness')
-                        else:
-                            changes.append('Created')
+            attributes = []
+            attribute_view = view.get_subview(view_type = 'UMLAttributeCompartmentView')
+            for attr in attribute_view.subviews:
+                if attr.type == 'UMLAttributeView':
+                    attributes.append(attr.text)
 
-                    if changes:
-                        new_association.has_changed(changes)
+            methods = []
+            method_view = view.get_subview(view_type = 'UMLOperationCompartmentView')
+            for op in method_view.subviews:
+                if op.type == 'UMLOperationView':
+                    methods.append(op.text)
 
-                    timeslice.append(new_association)
-
-                elif view.type == 'UMLPackageView':
-                    new_package = UMLPackage(obj_id = view.obj_id,
-                                             name = find_tree_elem_by_id(view, view.name_compartment).text,
-                                             parent_id = None,
-                                             nodes = view.contained_views,
-                                             subclusters = []
-                                             )
+            new_class = UMLClass(obj_id = view.obj_id,
+                                 name = class_model.name,
+                                 methods = methods,
+                                 attributes = attributes,
+                                 stereotype = class_model.stereotype)
 
-                    changes = []
+            changes = _detect_changes(prev_index, new_class, [('name', 'Name'), ('methods', 'Methods'),
+                                                              ('attributes', 'Attributes')])
 
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_package.obj_id)
+            new_class.has_changed(changes)
 
-                        if obj:
-                            if obj.name != new_package.name:
-                                changes.append('Name')
-                            if obj.parent_id != new_package.parent_id:
-                                changes.append('Parent package')
-                            if obj.nodes != new_package.nodes:
-                                changes.append('Contained elements')
-                            if obj.subclusters != new_package.subclusters:
-                                changes.append('Subclusters changed')
-                        else:
-                            changes.append('Created')
+            timeslice.append(new_class)
 
-                    if changes:
-                        new_package.has_changed(changes)
+        elif view.type == 'UMLInterfaceView':
 
-                    timeslice.append(new_package)
+            name_view = view.get_subview(view_type = 'UMLNameCompartmentView')
+            name_subview = name_view.get_subview(view_type = 'LabelView',
+                                                 view_id = name_view.name_label)
 
-                elif view.type == 'UMLUseCaseView':
+            new_interface = UMLInterface(obj_id = view.obj_id,
+                                         name = name_subview.text)
 
-                    new_usecase = UMLUseCase(obj_id = view.obj_id,
-                                             name = find_tree_elem_by_id
-                                             (root, find_tree_elem_by_id(view, view.name_compartment).model).name
-                                             )
+            changes = _detect_changes(prev_index, new_interface, [('name', 'Name')])
 
-                    changes = list()
+            new_interface.has_changed(changes)
 
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_usecase.obj_id)
+            timeslice.append(new_interface)
 
-                        if obj:
-                            if obj.name != new_usecase.name:
-                                changes.append('Name')
-                        else:
-                            changes.append('Created')
+        elif view.type in ['UMLAssociationView', 'UMLDependencyView', 'UMLGeneralizationView',
+                           'UMLInterfaceRealizationView']:
 
-                    if changes:
-                        new_usecase.has_changed(changes)
+            association = find_tree_elem_by_id(root, view.model)
 
-                    timeslice.append(new_usecase)
+            new_association = UMLAssociation(obj_id = view.obj_id,
+                                             from_id = view.tail,
+                                             to_id = view.head,
+                                             name = association.name,
+                                             directed = not association.navigable_end1,
+                                             aggregation = association.aggregation2,
+                                             multiplicities = (association.multiplicity1,
+                                                               association.multiplicity2),
+                                             dependency = view.type == 'UMLDependencyView',
+                                             generalization = view.type == 'UMLGeneralizationView',
+                                             realization = view.type == 'UMLInterfaceRealizationView')
 
-                elif view.type == 'UMLActorView':
+            changes = _detect_changes(prev_index, new_association, [('name', 'Name'), ('from_id', 'Tail'),
+                                                                    ('to_id', 'Head'), ('directed', 'Directedness'),
+                                                                    ('aggregation', 'Aggregatedness')])
 
-                    new_actor = UMLActor(obj_id = view.obj_id,
-                                         name = find_tree_elem_by_id(root, view.model).name
-                                         )
+            if changes:
+                new_association.has_changed(changes)
 
-                    changes = list()
+            timeslice.append(new_association)
 
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_actor.obj_id)
+        elif view.type == 'UMLPackageView':
+            new_package = UMLPackage(obj_id = view.obj_id,
+                                     name = find_tree_elem_by_id(view, view.name_compartment).text,
+                                     parent_id = None,
+                                     nodes = view.contained_views,
+                                     subclusters = []
+                                     )
 
-                        if obj:
-                            if obj.name != new_actor.name:
-                                changes.append('Name')
-                        else:
-                            changes.append('Created')
+            changes = _detect_changes(prev_index, new_package, [('name', 'Name'), ('parent_id', 'Parent package'),
+                                                                ('nodes', 'Contained elements'),
+                                                                ('subclusters', 'Subclusters changed')])
 
-                    if changes:
-                        new_actor.has_changed(changes)
+            if changes:
+                new_package.has_changed(changes)
 
-                    timeslice.append(new_actor)
+            timeslice.append(new_package)
 
-                elif view.type in ['UMLIncludeView', 'UMLExtendView']:
+        elif view.type == 'UMLUseCaseView':
 
-                    if view.type == 'UMLIncludeView':
-                        uml_class = UMLInclusion
-                    else:
-                        uml_class = UMLExtension
+            new_usecase = UMLUseCase(obj_id = view.obj_id,
+                                     name = find_tree_elem_by_id
+                                     (root, find_tree_elem_by_id(view, view.name_compartment).model).name
+                                     )
 
-                    new_inex = uml_class(obj_id = view.obj_id,
-                                         name = find_tree_elem_by_id(root, view.model).name,
-                                         from_id = view.tail,
-                                         to_id = view.head
-                                         )
+            changes = _detect_changes(prev_index, new_usecase, [('name', 'Name')])
 
-                    changes = list()
+            if changes:
+                new_usecase.has_changed(changes)
 
-                    if timeslice_array:
-                        obj = contains_class(timeslice_array[-1], new_inex.obj_id)
+            timeslice.append(new_usecase)
 
-                        if obj:
-                            if obj.name != new_inex.name:
-                                changes.append('Name')
-                            if obj.from_id != new_inex.from_id:
-                                changes.append('Tail')
-                            if obj.to_id != new_inex.to_id:
-                                changes.append('Head')
-                        else:
-                            changes.append('Created')
+        elif view.type == 'UMLActorView':
 
-                    if changes:
-                        new_inex.has_changed(changes)
+            new_actor = UMLActor(obj_id = view.obj_id,
+                                 name = find_tree_elem_by_id(root, view.model).name
+                                 )
 
-                    timeslice.append(new_inex)
+            changes = _detect_changes(prev_index, new_actor, [('name', 'Name')])
 
-            for elem in itertools.chain(node.owned_elements, node.owned_views, node.subviews):
-                timeslice = traverse_tree(elem, root, diagram_id, timeslice)
+            if changes:
+                new_actor.has_changed(changes)
 
-            return timeslice
+            timeslice.append(new_actor)
 
-        for p in parsed:
-            timeslice_array.append(traverse_tree(node = p, root = p, diagram_id = diagram_id, timeslice = list()))
+        elif view.type in ['UMLIncludeView', 'UMLExtendView']:
+
+            if view.type == 'UMLIncludeView':
+                uml_class = UMLInclusion
+            else:
+                uml_class = UMLExtension
+
+            new_inex = uml_class(obj_id = view.obj_id,
+                                 name = find_tree_elem_by_id(root, view.model).name,
+                                 from_id = view.tail,
+                                 to_id = view.head
+                                 )
+
+            changes = _detect_changes(prev_index, new_inex, [('name', 'Name'), ('from_id', 'Tail'),
+                                                             ('to_id', 'Head')])
+
+            if changes:
+                new_inex.has_changed(changes)
+
+            timeslice.append(new_inex)
+
+    return timeslice
+
+
+def _build_timeslice(tree, diagram_id, prev_timeslice):
+    """
+    Synopsis:
+        Turns a single parsed .mdj file into a timeslice. Changes are detected against the timeslice
+        of the previous revision. Errors are not handled here, but by the calling functions.
+    :param tree: parsed .mdj-file
+    :param diagram_id: ID of the diagram to be rendered
+    :param prev_timeslice: timeslice of the previous revision or None, if this is the first revision
+    :returns timeslice: list of Drawables
+    :returns diagram_found: True, if the tree contains the diagram with the given ID
+    """
+    diagram_found = [False]
+
+    prev_index = _index_timeslice(prev_timeslice) if prev_timeslice is not None else None
+
+    def traverse_tree(node, root, diagram_id, timeslice):
+        """
+        Synopsis:
+            Recursively traverses a parsed tree and transforms nodes into Drawable objects.
+        :param node: current node during traversal
+        :param root: parse tree top level node
+        :param diagram_id: ID of the diagram to be rendered
+        :param timeslice: current timeslice to which the Drawables are added
+        :returns timeslice: current timeslice
+        """
+        if node.obj_id.replace('/', '') == diagram_id:
+            diagram_found[0] = True
+            timeslice += _draw_views(node, root, prev_index)
+        elif diagram_id == 'all':
+            timeslice += _draw_views(node, root, prev_index)
+
+        for elem in itertools.chain(node.owned_elements, node.owned_views, node.subviews):
+            timeslice = traverse_tree(elem, root, diagram_id, timeslice)
+
+        return timeslice
+
+    timeslice = traverse_tree(node = tree, root = tree, diagram_id = diagram_id, timeslice = list())
+    return timeslice, diagram_found[0]
+
+
+def _build_diagram_timeslices(tree, prev_timeslices):
+    """
+    Synopsis:
+        Turns a single parsed .mdj file into the timeslices of all diagrams it contains, walking the tree once.
+        The Drawables of each diagram are detected against the previous timeslice of the same diagram.
+        The timeslice 'all' is composed of the Drawables of all diagrams in the order of traversal.
+        Errors are not handled here, but by the calling functions.
+    :param tree: parsed .mdj-file
+    :param prev_timeslices: dictionary of diagram IDs and their timeslices of the previous revision
+        or None, if this is the first revision
+    :returns timeslices: dictionary of diagram IDs and their timeslices, including 'all'
+    """
+    prev_indices = dict()
+    if prev_timeslices is not None:
+        for diagram_id, prev_timeslice in prev_timeslices.iteritems():
+            prev_indices[diagram_id] = _index_timeslice(prev_timeslice)
+    empty_index = dict() if prev_timeslices is not None else None
+
+    timeslices = {'all': list()}
+
+    def traverse_tree(node):
+        if 'Diagram' in node.type:
+            diagram_id = node.obj_id.replace('/', '')
+            drawables = _draw_views(node, tree, prev_indices.get(diagram_id, empty_index))
+            timeslices.setdefault(diagram_id, list()).extend(drawables)
+            timeslices['all'].extend(drawables)
+        elif node.owned_views:
+            timeslices['all'].extend(_draw_views(node, tree, prev_indices.get('all', empty_index)))
 
+        for elem in itertools.chain(node.owned_elements, node.owned_views, node.subviews):
+            traverse_tree(elem)
+
+    traverse_tree(tree)
+    return timeslices
+
+
+def get_timeslice(tree, diagram_id, prev_timeslice = None):
+    """
+    Synopsis:
+        Takes a single parsed .mdj file and turns it into a timeslice.
+        (i.e. a list of Drawable objects as specified in drawable.py)
+        This allows to extend an existing list of timeslices by a new revision.
+    :param tree: parsed .mdj-file
+    :param diagram_id: ID of the diagram to be rendered
+    :param prev_timeslice: timeslice of the previous revision or None, if this is the first revision
+    :returns timeslice: list of Drawables
+    :returns diagram_found: True, if the tree contains the diagram with the given ID
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    timeslice = list()
+    diagram_found = False
+    error_flag = False
+
+    try:
+        timeslice, diagram_found = _build_timeslice(tree, diagram_id, prev_timeslice)
+    except AttributeError:
+        traceback.print_exc()
+        timeslice = list()
+        error_flag = True
+    except TypeError:
+        traceback.print_exc()
+        timeslice = list()
+        error_flag = True
+    except ValueError:
+        traceback.print_exc()
+        timeslice = list()
+        error_flag = True
+    except NameError:
+        traceback.print_exc()
+        timeslice = list()
+        error_flag = True
+    except KeyError:
+        traceback.print_exc()
+        timeslice = list()
+        error_flag = True
+    finally:
+        return timeslice, diagram_found, error_flag
+
+
+def get_timeslices(parsed, diagram_id):
+    """
+    Synopsis:
+        Takes a list of parsed .mdj files and turns them into a list of timeslices.
+        (i.e. a list of lists of Drawable objects as specified in drawable.py)
+    :param parsed: list or parsed .mdj-files
+    :param diagram_id: ID of the diagram to be rendered
+    :returns timeslice_array: list of timeslices
+    :returns error_flag: indicator that an error occurrec during execution
+    """
+    timeslice_array = list()
+    error_flag = False
+
+    try:
+        prev_timeslice = None
+        for p in parsed:
+            prev_timeslice = _build_timeslice(p, diagram_id, prev_timeslice)[0]
+            timeslice_array.append(prev_timeslice)
     except AttributeError:
         traceback.print_exc()
         timeslice_array = []
@@ -352,3 +413,57 @@ def get_timeslices(parsed, diagram_id):
         error_flag = True
     finally:
         return timeslice_array, error_flag
+
+
+def get_timeslices_per_diagram(parsed):
+    """
+    Synopsis:
+        Takes a list of parsed .mdj files and turns them into lists of timeslices for all diagrams at once.
+        Every parsed file is walked only once, no matter how many diagrams it contains. The result for each
+        diagram equals get_timeslices(parsed, diagram_id); the key 'all' holds get_timeslices(parsed, 'all').
+    :param parsed: list or parsed .mdj-files
+    :returns timeslice_arrays: dictionary of diagram IDs and their lists of timeslices
+    :returns diagram_revisions: dictionary of diagram IDs and lists of booleans, indicating for every revision
+        whether it contains the diagram
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    timeslice_arrays = {'all': list()}
+    diagram_revisions = dict()
+    error_flag = False
+
+    try:
+        prev_timeslices = None
+        for n, p in enumerate(parsed):
+            timeslices = _build_diagram_timeslices(p, prev_timeslices)
+            for diagram_id in timeslices:
+                if diagram_id not in timeslice_arrays:
+                    timeslice_arrays[diagram_id] = [list() for _ in range(n)]
+                    diagram_revisions[diagram_id] = [False] * n
+            for diagram_id, timeslice_array in timeslice_arrays.iteritems():
+                timeslice_array.append(timeslices.get(diagram_id, list()))
+                if diagram_id != 'all':
+                    diagram_revisions[diagram_id].append(diagram_id in timeslices)
+            prev_timeslices = dict((diagram_id, timeslice_array[-1])
+                                   for diagram_id, timeslice_array in timeslice_arrays.iteritems())
+    except AttributeError:
+        traceback.print_exc()
+        timeslice_arrays, diagram_revisions = {'all': list()}, dict()
+        error_flag = True
+    except TypeError:
+        traceback.print_exc()
+        timeslice_arrays, diagram_revisions = {'all': list()}, dict()
+        error_flag = True
+    except ValueError:
+        traceback.print_exc()
+        timeslice_arrays, diagram_revisions = {'all': list()}, dict()
+        error_flag = True
+    except NameError:
+        traceback.print_exc()
+        timeslice_arrays, diagram_revisions = {'all': list()}, dict()
+        error_flag = True
+    except KeyError:
+        traceback.print_exc()
+        timeslice_arrays, diagram_revisions = {'all': list()}, dict()
+        error_flag = True
+    finally:
+        return timeslice_arrays, diagram_revisions, error_flag
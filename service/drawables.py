@@ -25,15 +25,20 @@ A Drawable at least implements the following:
 1. draw(ga) - a function that draws it into the given graph animator
 2. log(created) - a function that documents the Drawables status textually
 3. __eq__(other) - comparison magic function
+Additionally, a Drawable lists the attributes that describe its state in FINGERPRINT_FIELDS.
+The fingerprint is the tuple of these attributes, so unchanged Drawables are detected with a single comparison.
 """
 
 import libs.gvanim.config
 
 
 class Drawable(object):
+    FINGERPRINT_FIELDS = ()
+
     def __init__(self, obj_id):
         self.obj_id = obj_id
         self.changes = []
+        self._fingerprint = None
 
     def draw(self, ga):
         print 'The Drawable with the ID %s has no implemented draw function yet.' % str(self.obj_id)
@@ -47,6 +52,12 @@ class Drawable(object):
     def has_changed(self, changes):
         self.changes = changes
 
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = tuple(tuple(value) if isinstance(value, list) else value
+                                      for value in (getattr(self, field) for field in self.FINGERPRINT_FIELDS))
+        return self._fingerprint
+
     @staticmethod
     def _uml_label(name, methods = None, attributes = None, stereotype = None):
         string = ''
@@ -241,6 +252,8 @@ class Drawable(object):
 
 
 class UMLClass(Drawable):
+    FINGERPRINT_FIELDS = ('name', 'methods', 'attributes', 'stereotype')
+
     def __init__(self, obj_id, name = '', methods = None, attributes = None, stereotype = None):
         Drawable.__init__(self, obj_id)
         self.name = name
@@ -279,6 +292,8 @@ class UMLClass(Drawable):
 
 
 class UMLInterface(Drawable):
+    FINGERPRINT_FIELDS = ('name',)
+
     def __init__(self, obj_id, name = ''):
         Drawable.__init__(self, obj_id)
         self.name = name
@@ -309,6 +324,9 @@ class UMLInterface(Drawable):
 
 
 class UMLAssociation(Drawable):
+    FINGERPRINT_FIELDS = ('from_id', 'to_id', 'name', 'multiplicities', 'directed', 'aggregation', 'dependency',
+                          'generalization', 'realization', 'stereotype')
+
     def __init__(self, obj_id, from_id, to_id, name = '', multiplicities = (None, None),
                  directed = False, aggregation = False, dependency = False, generalization = False,
                  realization = False, stereotype = None):
@@ -392,6 +410,8 @@ class UMLAssociation(Drawable):
 
 
 class UMLPackage(Drawable):
+    FINGERPRINT_FIELDS = ('name', 'parent_id', 'nodes', 'subclusters')
+
     def __init__(self, obj_id, parent_id = None, name = '', nodes = None, subclusters = None):
         Drawable.__init__(self, obj_id)
         self.name = name
@@ -442,6 +462,8 @@ class UMLPackage(Drawable):
 
 
 class UMLUseCase(Drawable):
+    FINGERPRINT_FIELDS = ('name',)
+
     def __init__(self, obj_id, name = ''):
         Drawable.__init__(self, obj_id)
         self.name = name
@@ -473,6 +495,8 @@ class UMLUseCase(Drawable):
 
 
 class UMLActor(Drawable):
+    FINGERPRINT_FIELDS = ('name',)
+
     def __init__(self, obj_id, name = ''):
         Drawable.__init__(self, obj_id)
         self.name = name
@@ -506,6 +530,8 @@ class UMLActor(Drawable):
 
 
 class UMLExtensionInclude(Drawable):
+    FINGERPRINT_FIELDS = ('from_id', 'to_id', 'name', 'obj_type')
+
     def __init__(self, obj_id, from_id, to_id, name = '', obj_type = 'inclusion'):
         Drawable.__init__(self, obj_id)
         self.from_id = from_id
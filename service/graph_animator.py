@@ -19,16 +19,23 @@ You should have received a copy of the GNU General Public License
 along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from libs.gvanim import Animation, render, gif
+import os
+from libs.gvanim import Animation, render, gif, render_graph, pad_frame, layout
+from libs.gvanim.config import STABLE_LAYOUT
 
 
-def render_timeslices(timeslice_array, disable_rendering=False):
+def _build_graphs(timeslice_array, stable_layout = False):
     """
     Synopsis:
-        Renders all timeslices to .png images. Returns graphviz .dot definitions for the images.
-    :param timeslice_array: list of timeslices to be rendered
-    :param disable_rendering: if True, only .dot files are returned and no images are rendered
-    :returns graphs: .dot definitions of rendered images
+        Turns a list of timeslices into graphviz .dot definitions, one per timeslice.
+        Every definition depends on the complete list, since objects of other timeslices are kept as invisible nodes.
+        With stable_layout the last frame, which contains every node of the history, is laid out once and
+        all definitions are given its node positions. Histories containing packages are always laid out per frame,
+        since their clusters differ between frames.
+    :param timeslice_array: list of timeslices
+    :param stable_layout: if True, the definitions are to be drawn with fixed positions
+    :returns graphs: .dot definitions of all frames
+    :returns engine: graphviz program the definitions are to be drawn with
     """
     ga = Animation()
     first = True
@@ -53,7 +60,59 @@ def render_timeslices(timeslice_array, disable_rendering=False):
                 uc_diagram = True
 
     graphs = ga.graphs(use_cases, actors, uc_diagram)
+    if stable_layout and graphs and not ga.has_clusters():
+        graphs = ga.graphs(use_cases, actors, uc_diagram, layout = layout(graphs[-1]))
+        return graphs, 'neato'
+    return graphs, 'dot'
+
+
+def render_timeslices(timeslice_array, disable_rendering=False, folder='.'):
+    """
+    Synopsis:
+        Renders all timeslices to .png images. Returns graphviz .dot definitions for the images.
+    :param timeslice_array: list of timeslices to be rendered
+    :param disable_rendering: if True, only .dot files are returned and no images are rendered
+    :param folder: folder the images, the animated .gif and the .dot files are written to
+    :returns graphs: .dot definitions of rendered images
+    """
+    graphs, engine = _build_graphs(timeslice_array, stable_layout = STABLE_LAYOUT and not disable_rendering)
     if not disable_rendering:
-        files = render(graphs, 'dfv', 'png', xdim = 9, ydim = 9)
-        gif(files, 'dfv', delay = 140, xdim = 9, ydim = 9)
+        files = render(graphs, os.path.join(folder, 'dfv'), 'png', xdim = 9, ydim = 9, engine = engine)
+        gif(files, os.path.join(folder, 'dfv'), delay = 140, xdim = 9, ydim = 9)
     return graphs
+
+
+def render_frame(timeslice_array, frame, folder):
+    """
+    Synopsis:
+        Renders a single frame of the history to a .png image inside the given folder. The image equals the
+        corresponding image rendered by render_timeslices, but no other frame is rendered.
+    :param timeslice_array: list of timeslices of the complete history
+    :param frame: index of the frame to be rendered
+    :param folder: folder the image is written to
+    :returns path: path of the rendered image or an empty string, if the frame does not exist
+    """
+    graphs, engine = _build_graphs(timeslice_array, stable_layout = STABLE_LAYOUT)
+    if frame >= len(graphs):
+        return ''
+    path = os.path.join(folder, 'dfv_{:03}.png'.format(frame))
+    render_graph(graphs[frame], path, 'png', xdim = 9, ydim = 9, engine = engine)
+    pad_frame(path, xdim = 9, ydim = 9)
+    return path
+
+
+def get_frame_graph(timeslice):
+    """
+    Synopsis:
+        Returns the nodes and edges shown in the frame of a timeslice, without building .dot definitions.
+        Every step of an animation starts empty, so a frame shows exactly the objects drawn for its own timeslice,
+        and its visible nodes and edges do not depend on the other timeslices of the history.
+    :param timeslice: timeslice whose frame is to be described
+    :returns nodes: sorted list of the IDs of the visible nodes
+    :returns edges: sorted list of (source ID, target ID) tuples of the visible edges
+    """
+    ga = Animation()
+    for drawable in timeslice:
+        drawable.draw(ga = ga)
+    step = ga.steps()[-1]
+    return sorted(step.V), sorted(step.E)
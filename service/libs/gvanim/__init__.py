@@ -21,4 +21,4 @@ You should have received a copy of the GNU General Public License along with
 """
 
 from .animation import Animation
-from .render import render, gif
+from .render import render, gif, render_graph, pad_frame, layout, RenderException
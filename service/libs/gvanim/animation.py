@@ -164,7 +164,11 @@ class Animation( object ):
             action( steps )
         return steps
 
-    def graphs( self , use_cases, actors, uc_diagram):
+    def has_clusters( self ):
+        return any( step.C for step in self.steps() )
+
+    def graphs( self , use_cases, actors, uc_diagram, layout = None):
+        # layout maps node names to fixed positions in points, as returned by render.layout
         steps = self.steps()
         C, V, E = dict(), set(), set()
         for step in steps:
@@ -185,11 +189,16 @@ class Animation( object ):
                      '{rank=min;%s}' % "".join(list(map(lambda x: '"%s";' % x, actors_first_half))),
                      '{rank=same;%s}' % "".join(list(map(lambda x: '"%s";' % x, use_cases))),
                      '{rank=max;%s}' % "".join(list(map(lambda x: '"%s";' % x, actors_second_half)))]
+            if layout:
+                graph.append( 'splines=true' )
             counter = 0
             # for each cluster handle contents
             for key in s.C:
                 counter = self.handle_cluster(s.C, key, counter, graph, s)
-            for v in V: graph.append( u'"{}" {};'.format( quote( str( v ) ).encode('utf-8'), s.node_format( v, hide = v not in s.V ) ) )
+            for v in V:
+                graph.append( u'"{}" {};'.format( quote( str( v ) ).encode('utf-8'), s.node_format( v, hide = v not in s.V ) ) )
+                if layout and quote( str( v ) ) in layout:
+                    graph.append( '"{}" [pos="{:.2f},{:.2f}!"];'.format( quote( str( v ) ), *layout[ quote( str( v ) ) ] ) )
             for e in E:
                 graph.append( '"{}" -> "{}" {};'.format( quote( str( e[ 0 ] ) ), quote( str( e[ 1 ] ) ), s.edge_format( e, hide = e not in s.E ) ) )
             graph.append( '}' )
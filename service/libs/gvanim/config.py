@@ -24,6 +24,13 @@ image_magick_convert_path = r"~/example/path"   # path to convert executable
 font_path = r"~/example/path"                   # path to used font folder
 font_name = r"your_font.ttf"                    # you should use a unicode font, i.e. a font supporting a wide range of alphabets
 
+#  RENDERING
+RENDER_WORKERS = 0                              # number of concurrent dot/convert processes, 0 uses one per cpu core
+STABLE_LAYOUT = False                           # if true the history is laid out once and every frame is drawn with fixed node positions
+render_store_path = r"render_store"             # folder of the shared store of rendered images, relative to the SNAPE root unless absolute, empty disables the store
+RENDER_STORE_MAX_BYTES = 1e9                    # quota of the render store in bytes of stored images, least recently used images are evicted beyond it
+                                                # images hard linked into the caches are counted in full, so this limits stored images, not unique disk blocks
+
 #  STYLE
 NODE_COLOR = '"#FFFFFF"'
 NODE_INSIDE_COLOR = '"purple"'
@@ -21,26 +21,87 @@ You should have received a copy of the GNU General Public License along with
 """
 
 from subprocess import Popen, PIPE, STDOUT, call
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
-from config import image_magick_convert_path
+import shlex
+from config import image_magick_convert_path, RENDER_WORKERS
+import store
 
-def render( graphs, basename, fmt = 'png' , xdim = 10, ydim = 8):
-	paths = []
-	for n, graph in enumerate( graphs ):
-		with open('temp_dot_file_%i.txt' % n, 'w') as stats_file:
+class RenderException( Exception ):
+	pass
+
+def _discard( path ):
+	if os.path.isfile( path ):
+		os.remove( path )
+
+def _map( function, items ):
+	# runs function on all items with a bounded number of concurrent subprocesses, results keep the order of items
+	workers = min( RENDER_WORKERS if RENDER_WORKERS > 0 else cpu_count(), len( items ) )
+	if workers <= 1:
+		return map( function, items )
+	pool = ThreadPool( workers )
+	try:
+		return pool.map( function, items )
+	finally:
+		pool.close()
+		pool.join()
+
+def layout( graph ):
+	# lays out a graph once with dot and returns the positions of its nodes in points, to be kept fixed by neato -n2
+	pipe = Popen( [ 'dot', '-Tplain' ], stdout = PIPE, stdin = PIPE, stderr = None, close_fds = True )
+	plain = pipe.communicate( input = graph )[ 0 ]
+	positions = {}
+	for line in plain.split( '\n' ):
+		try:
+			parts = shlex.split( line )
+		except ValueError:
+			continue
+		if len( parts ) > 3 and parts[ 0 ] == 'node':
+			positions[ parts[ 1 ] ] = ( float( parts[ 2 ] ) * 72, float( parts[ 3 ] ) * 72 )
+	return positions
+
+def render_graph( graph, path, fmt = 'png', xdim = 10, ydim = 8, engine = 'dot' ):
+	cmd = [ engine ] + ( [ '-n2' ] if engine == 'neato' else [] ) + [ '-T', fmt , '-Gsize=%i,%i\\!' % (xdim,ydim), '-Gdpi=100']
+	render_key = store.key( 'render', ' '.join( cmd ), graph )
+	if store.fetch( render_key, path ):
+		return path
+	with open( path + '.tmp' , 'w' ) as out:	# path may be linked to a stored image, never write it in place
+		pipe = Popen( cmd, stdout = out, stdin = PIPE, stderr = None, close_fds = True )
+		pipe.communicate( input = graph )
+	if pipe.returncode != 0 or os.path.getsize( path + '.tmp' ) == 0:	# never store a failed render under its key
+		_discard( path + '.tmp' )
+		raise RenderException( '{} failed with exit code {}'.format( engine, pipe.returncode ) )
+	os.rename( path + '.tmp', path )
+	store.add( render_key, path )
+	return path
+
+def pad_frame( file, xdim = 10, ydim = 8 ):
+	with open( file, 'rb' ) as image:
+		pad_key = store.key( 'pad', xdim, ydim, image.read() )
+	if store.fetch( pad_key, file ):
+		return
+	padded_file = os.path.splitext( file )[ 0 ] + '.padded.png'
+	cmd = [image_magick_convert_path]
+	cmd.extend( ( file, '-gravity', 'center', '-background', '#411F48', '-extent', '%i00x%i00' % (xdim,ydim), padded_file ) )					#-background -> padding
+	returncode = call( cmd )
+	if returncode != 0 or not os.path.isfile( padded_file ) or os.path.getsize( padded_file ) == 0:
+		_discard( padded_file )
+		raise RenderException( 'convert failed with exit code {}'.format( returncode ) )
+	os.rename( padded_file, file )
+	store.add( pad_key, file )
+
+def render( graphs, basename, fmt = 'png' , xdim = 10, ydim = 8, engine = 'dot' ):
+	def render_frame( frame ):
+		n, graph = frame
+		with open( os.path.join( os.path.dirname( basename ), 'temp_dot_file_%i.txt' % n ), 'w') as stats_file:
 			stats_file.write(graph)
-		path = '{}_{:03}.{}'.format( basename, n, fmt )
-		with open( path , 'w' ) as out:
-			pipe = Popen( [ 'dot', '-T', fmt , '-Gsize=%i,%i\\!' % (xdim,ydim), '-Gdpi=100'], stdout = out, stdin = PIPE, stderr = None )
-			pipe.communicate( input = graph )
-		paths.append( path )
-	return paths
+		return render_graph( graph, '{}_{:03}.{}'.format( basename, n, fmt ), fmt, xdim, ydim, engine )
+
+	return _map( render_frame, list( enumerate( graphs ) ) )
 
 def gif( files, basename, delay = 100 , xdim = 10, ydim = 8):
-	for file in files:
-		cmd = [image_magick_convert_path]
-		cmd.extend( ( file, '-gravity', 'center', '-background', '#411F48', '-extent', '%i00x%i00' % (xdim,ydim), file ) )					#-background -> padding
-		call( cmd )
+	_map( lambda file: pad_frame( file, xdim, ydim ), list( files ) )
 
 	cmd = [image_magick_convert_path]
 	for file in files:
@@ -0,0 +1,119 @@
+# coding=utf-8
+
+"""
+Original author: Copyright 2016, Massimo Santini <santini@di.unimi.it>
+Modified by: Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of "GraphvizAnim".
+
+"GraphvizAnim" is free software: you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+"GraphvizAnim" is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+details.
+
+You should have received a copy of the GNU General Public License along with
+"GraphvizAnim". If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# shared store of rendered images, addressed by a hash of everything the image is rendered from
+# images are hard linked into their destinations, so they must never be modified in place
+
+from __future__ import absolute_import
+import os
+import hashlib
+import threading
+from shutil import copyfile
+from config import ROOT
+from libs.gvanim.config import render_store_path, RENDER_STORE_MAX_BYTES
+
+_folder = os.path.join( ROOT, render_store_path ) if render_store_path else ''	# relative to the SNAPE root like all data folders
+_lock = threading.Lock()
+_size = [ None ]	# total size of the stored images, determined on first use
+
+def key( *parts ):
+	digest = hashlib.sha1()
+	for part in parts:
+		digest.update( part.encode( 'utf-8' ) if isinstance( part, unicode ) else str( part ) )
+		digest.update( '\0' )
+	return digest.hexdigest()
+
+def _path( key ):
+	return os.path.join( _folder, key[ :2 ], key )
+
+def fetch( key, path ):
+	# places the stored image for key at path, returns False if there is none
+	if not _folder or not os.path.isfile( _path( key ) ):
+		return False
+	temp_path = path + '.fetch'
+	try:
+		os.link( _path( key ), temp_path )
+	except OSError:
+		try:
+			copyfile( _path( key ), temp_path )
+		except IOError:
+			return False
+	os.rename( temp_path, path )
+	try:
+		os.utime( _path( key ), None )	# mtime is the recency of use for eviction
+	except OSError:
+		pass
+	return True
+
+def add( key, path ):
+	# stores the image at path for key, the image must not be modified afterwards
+	if not _folder or not os.path.isfile( path ):
+		return
+	stored_path = _path( key )
+	try:
+		if not os.path.isdir( os.path.dirname( stored_path ) ):
+			os.makedirs( os.path.dirname( stored_path ) )
+		os.link( path, stored_path )
+	except OSError:
+		try:
+			if os.path.exists( stored_path ):
+				return
+			copyfile( path, stored_path + '.tmp' )
+			os.rename( stored_path + '.tmp', stored_path )
+		except ( IOError, OSError ):
+			return
+	with _lock:
+		if _size[ 0 ] is not None:
+			_size[ 0 ] += os.path.getsize( stored_path )
+		if _stored_size() > RENDER_STORE_MAX_BYTES:
+			_evict( 0.9 * RENDER_STORE_MAX_BYTES )
+
+def _stored_files():
+	for folder, dirs, files in os.walk( _folder ):
+		for name in files:
+			yield os.path.join( folder, name )
+
+def _stored_size():
+	# counts every stored image in full, also if it shares its disk blocks with links in the caches
+	if _size[ 0 ] is None:
+		_size[ 0 ] = sum( os.path.getsize( path ) for path in _stored_files() )
+	return _size[ 0 ]
+
+def _evict( target_size ):
+	# removes the least recently used images until the store is smaller than target_size
+	entries = []
+	for path in _stored_files():
+		try:
+			stat = os.stat( path )
+		except OSError:
+			continue
+		entries.append( ( stat.st_mtime, stat.st_size, path ) )
+	size = sum( entry[ 1 ] for entry in entries )
+	for mtime, file_size, path in sorted( entries ):
+		if size <= target_size:
+			break
+		try:
+			os.remove( path )
+			size -= file_size
+		except OSError:
+			pass
+	_size[ 0 ] = size
@@ -20,7 +20,17 @@ along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import json
+import os
+import re
+import hashlib
+import threading
+import cPickle as pickle
 import traceback
+from collections import OrderedDict
+from config import PARSE_CACHE_MAX_BYTES, PARSE_CACHE_PERSIST, UPLOAD_CHUNK_SIZE
+import revision_storage as storage
+
+__DIAGRAM_TYPE = re.compile(r'"_type"\s*:\s*"[^"\\]*Diagram')  # _type of a view that is a diagram
 
 
 class Entry(object):
@@ -80,6 +90,9 @@ class Entry(object):
         self.owned_views = []
         self.subviews = []
 
+        # obj_id -> Entry lookup table, only set on the root of a parse tree
+        self.index = None
+
     def __repr__(self):
         owned_element_names = ''
         owned_view_names = ''
@@ -170,11 +183,116 @@ class Entry(object):
         return result
 
 
-def __load_json(filename):
-    return json.loads(open(filename).read().decode('utf-8'))
-
-
-def __tree_builder(obj, level = 0):
+class ModelCache(object):
+    """
+    Synopsis:
+        LRU cache of parsed object trees. Entries are keyed by the path of a revision file and validated against
+        its modification time and size. The byte budget is measured in bytes of the cached .mdj files.
+        If persistence is enabled, parsed trees are additionally pickled next to their revision file, together
+        with a hash of the file content, so that a restarted server does not need to decode the JSON again.
+    """
+    PICKLE_FORMAT = 2
+
+    def __init__(self, max_bytes, persist = False):
+        self.max_bytes = max_bytes
+        self.persist = persist
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stamp(mdj_file):
+        stat = os.stat(mdj_file)
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def persisted_path(mdj_file):
+        return os.path.join(os.path.dirname(mdj_file), '.%s.parsed' % storage.model_name(mdj_file))
+
+    def get(self, mdj_file, stamp):
+        with self._lock:
+            entry = self._entries.pop(mdj_file, None)
+            if entry is not None:
+                if entry[0] == stamp:
+                    self._entries[mdj_file] = entry
+                    self.hits += 1
+                    return entry[1]
+                self._size -= entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, mdj_file, stamp, tree, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old_entry = self._entries.pop(mdj_file, None)
+            if old_entry is not None:
+                self._size -= old_entry[2]
+            while self._entries and self._size + size > self.max_bytes:
+                self._size -= self._entries.popitem(last = False)[1][2]
+                self.evictions += 1
+            self._entries[mdj_file] = (stamp, tree, size)
+            self._size += size
+
+    def load_persisted(self, mdj_file, digest):
+        if not self.persist or not os.path.isfile(self.persisted_path(mdj_file)):
+            return None
+        try:
+            with open(self.persisted_path(mdj_file), 'rb') as persisted:
+                file_format, file_digest, tree = pickle.load(persisted)
+        except Exception:
+            traceback.print_exc()
+            return None
+        if file_format != self.PICKLE_FORMAT or file_digest != digest:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        return tree
+
+    def save_persisted(self, mdj_file, digest, tree):
+        if not self.persist:
+            return
+        path = self.persisted_path(mdj_file)
+        temp_path = '%s.%i.tmp' % (path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as persisted:
+                pickle.dump((self.PICKLE_FORMAT, digest, tree), persisted, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+        except (IOError, OSError, pickle.PicklingError):
+            traceback.print_exc()
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def statistics(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_model_cache = ModelCache(max_bytes = PARSE_CACHE_MAX_BYTES, persist = PARSE_CACHE_PERSIST)
+
+
+def __read_file(filename):
+    return storage.read_revision(filename)
+
+
+def __tree_builder(obj, level = 0, index = None):
     contained_views = obj.get('containedViews', [])
     refined_contained_views = []
     for elem in contained_views:
@@ -201,18 +319,43 @@ def __tree_builder(obj, level = 0):
                  aggregation2 = obj.get('end2', {}).get('aggregation', False),
                  multiplicity1 = obj.get('end1', {}).get('multiplicity', ''),
                  multiplicity2 = obj.get('end2', {}).get('multiplicity', ''))
+    if index is not None:
+        index.setdefault(node.obj_id, node)
     for elem in obj.get('ownedElements', []):
-        node.add_owned_element(__tree_builder(elem, level = level + 1))
+        node.add_owned_element(__tree_builder(elem, level = level + 1, index = index))
     for view in obj.get('ownedViews', []):
-        node.add_owned_view(__tree_builder(view, level = level + 1))
+        node.add_owned_view(__tree_builder(view, level = level + 1, index = index))
     for subview in obj.get('subViews', []):
-        node.add_subview(__tree_builder(subview, level = level + 1))
+        node.add_subview(__tree_builder(subview, level = level + 1, index = index))
     return node
 
 
+def __build_tree(obj):
+    """
+    Synopsis:
+        Builds the object tree of a decoded .mdj file. While the tree is constructed, an obj_id -> Entry
+        dictionary is collected and attached to the root as *index*. If IDs are ambiguous, the first node
+        in depth-first order wins, which matches the result of a recursive search.
+    :param obj: decoded JSON object of a .mdj file
+    :returns tree: root of the object tree
+    """
+    index = dict()
+    tree = __tree_builder(obj, index = index)
+    tree.index = index
+    return tree
+
+
 def __create_obj_tree(mdj_file):
-    obj = __load_json(mdj_file)
-    tree = __tree_builder(obj)
+    stamp = _model_cache.stamp(mdj_file)
+    tree = _model_cache.get(mdj_file, stamp)
+    if tree is None:
+        content = __read_file(mdj_file)
+        digest = hashlib.sha1(content).hexdigest()
+        tree = _model_cache.load_persisted(mdj_file, digest)
+        if tree is None:
+            tree = __build_tree(json.loads(content.decode('utf-8')))
+            _model_cache.save_persisted(mdj_file, digest, tree)
+        _model_cache.put(mdj_file, stamp, tree, len(content))
     return tree
 
 
@@ -220,6 +363,8 @@ def parse_models(mdj_array):
     """
     Synopsis:
         Takes a list of .mdj files and parses them into an object tree for the diff_analyzer.
+        Parsed trees are served from the model cache if the file has not changed since it was last parsed.
+        The returned trees are shared between callers and must not be modified.
     :param mdj_array: list of paths to .mdj files to be parsed
     :returns parsed_models: list of object trees
     """
@@ -244,3 +389,87 @@ def parse_models(mdj_array):
         parsed_models = []
     finally:
         return parsed_models
+
+
+def contains_diagram(mdj_file):
+    """
+    Synopsis:
+        Checks whether a .mdj file contains at least one diagram, without decoding it. The file is scanned
+        in chunks of UPLOAD_CHUNK_SIZE bytes and the scan stops at the first element of a *Diagram type.
+    :param mdj_file: path to the .mdj file
+    :returns diagram_found: boolean
+    """
+    tail = ''
+    model_file = storage.open_revision(mdj_file)
+    try:
+        for chunk in iter(lambda: model_file.read(UPLOAD_CHUNK_SIZE), ''):
+            if __DIAGRAM_TYPE.search(tail + chunk):
+                return True
+            tail = chunk[-256:]  # a match may span two chunks
+    finally:
+        model_file.close()
+    return False
+
+
+def catalog_path(mdj_file):
+    """
+    Synopsis:
+        Returns the path of the diagram catalog of a .mdj file, which is stored next to it.
+    :param mdj_file: path to the .mdj file
+    :returns path: string
+    """
+    return os.path.join(os.path.dirname(mdj_file), '.%s.catalog.json' % storage.model_name(mdj_file))
+
+
+def __collect_diagrams(obj, diagrams):
+    if 'Diagram' in (obj.get('_type', None) or ''):
+        diagrams.append((obj.get('name', None), obj.get('_id', '').replace('/', '')))
+    for key in ('ownedElements', 'ownedViews', 'subViews'):
+        for elem in obj.get(key, []):
+            __collect_diagrams(elem, diagrams)
+    return diagrams
+
+
+def get_catalog(mdj_file):
+    """
+    Synopsis:
+        Returns the names and IDs of the diagrams contained in a .mdj file, in the order of
+        diff_analyzer.get_diagram_names_and_ids. The catalog is read from its file next to the .mdj file.
+        If there is none yet, the .mdj file is decoded, without building an object tree, and the catalog
+        is stored for later calls.
+    :param mdj_file: path to the .mdj file
+    :returns diagram_list: list of (diagram name, diagram ID) tuples, or None if the file could not be decoded
+    """
+    path = catalog_path(mdj_file)
+    if os.path.isfile(path):
+        try:
+            with open(path, 'rb') as catalog_file:
+                return [tuple(diagram) for diagram in json.load(catalog_file)]
+        except ValueError:
+            traceback.print_exc()
+
+    try:
+        diagram_list = __collect_diagrams(json.loads(__read_file(mdj_file).decode('utf-8')), list())
+    except (AttributeError, TypeError, ValueError):
+        traceback.print_exc()
+        return None
+
+    temp_path = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as catalog_file:
+            json.dump(diagram_list, catalog_file)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        traceback.print_exc()
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+    return diagram_list
+
+
+def get_cache_statistics():
+    """
+    Synopsis:
+        Returns the counters of the parsed model cache. Useful to size *PARSE_CACHE_MAX_BYTES*.
+    :returns statistics: dictionary of hits, disk hits, misses, evictions, entry count and byte sizes
+    """
+    return _model_cache.statistics()
@@ -21,25 +21,22 @@ along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import traceback
-import codecs
-from config import ROOT
+import logging
+from contextlib import contextmanager
+from config import ROOT, LOCK_WAIT_LOG_THRESHOLD, DELTA_SNAPSHOT_INTERVAL
 import portalocker as plocker
 import re
 import time
+import tempfile
+import json
 from shutil import rmtree
+import project_index as index
+import revision_storage as storage
 
-
-def __natural_sort(l):
-    """
-    Synopsis:
-        Takes a list and returns it in natural sorted order.
-        E.g.: [Obj1, Obj7, Obj3, Obj13, Obj11] -> [Obj1, Obj3, Obj7, Obj11, Obj13]
-    :param l: list to be sorted
-    :returns l: sorted list
-    """
-    def convert(text):
-        return int(text) if text.isdigit() else text.lower()
-    return sorted(l, key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)])
+LOCK_FOLDER = os.path.join('database', 'locks')  # holds one lock file per project
+BLOB_FOLDER = 'blobs'  # folder inside a project folder that holds the files shared by identical revisions
+STATISTICS_DATA_FILE = 'revisions.json'  # file inside the statistics folder of a project that holds the data points
+STATISTICS_VERSION_FILE = 'version.txt'  # file inside the statistics folder that identifies the revisions of the images
 
 
 def __secure_filename(filename, allowed = ''):
@@ -75,58 +72,189 @@ def __secure_foldername(foldername):
     return "".join([c if c.isalpha() or c.isdigit() else '_' for c in foldername]).rstrip()
 
 
+def __is_model_file(file_name):
+    """
+    Synopsis:
+        Checks whether a file inside a revision folder is the uploaded model itself.
+        Hidden files (e.g. the persisted parse results of the model_parser) are auxiliary data.
+    :param file_name: name of the file to be checked
+    :returns is_model: boolean
+    """
+    return not file_name.startswith('.')
+
+
+@contextmanager
+def __locked(lock_path, exclusive):
+    """
+    Synopsis:
+        Claims the system lock of the given lock file for the duration of a with-block.
+        Waiting times above LOCK_WAIT_LOG_THRESHOLD are reported in the log.
+    :param lock_path: path of the lock file
+    :param exclusive: if True the lock is claimed exclusively, else it is shared with other readers
+    """
+    with open(lock_path, 'a', 0) as lock_file:
+        start = time.time()
+        plocker.lock(lock_file, plocker.LOCK_EX if exclusive else plocker.LOCK_SH)
+        waited = time.time() - start
+        if waited >= LOCK_WAIT_LOG_THRESHOLD:
+            logging.info('Waited %.3fs for %s lock %s' % (waited, 'exclusive' if exclusive else 'shared', lock_path))
+        yield
+
+
+def __lock_path(name):
+    """
+    Synopsis:
+        Returns the path of a lock file in the lock folder of the database.
+        The folder is created if it does not exist yet.
+    :param name: name of the lock without extension
+    :returns lock_path: string
+    """
+    try:
+        os.makedirs(LOCK_FOLDER)
+    except OSError:
+        if not os.path.isdir(LOCK_FOLDER):
+            raise
+    return os.path.join(LOCK_FOLDER, name + '.lock')
+
+
+@contextmanager
+def __database_lock():
+    """
+    Synopsis:
+        Claims the *db.lock* system lock exclusively, which excludes all other database operations.
+        Only used for creating and deleting projects and for (re)building the project index.
+    """
+    with __locked(os.path.join('database', 'db.lock'), exclusive = True):
+        yield
+
+
+@contextmanager
+def __project_lock(project_id, exclusive = False):
+    """
+    Synopsis:
+        Claims the *db.lock* system lock shared and the lock of the given project either shared (for reading)
+        or exclusively (for writing), so operations on different projects do not wait for each other.
+    :param project_id: sanitized ID of the project
+    :param exclusive: if True the project lock is claimed exclusively
+    """
+    __ensure_index()
+    with __locked(os.path.join('database', 'db.lock'), exclusive = False):
+        with __locked(__lock_path(project_id), exclusive = exclusive):
+            yield
+
+
+def __scan_projects():
+    """
+    Synopsis:
+        Collects all projects and revision files by walking the database folder.
+    :returns projects: dictionary of project IDs and lists of (revision ID, path to .mdj file) tuples
+    """
+    projects = dict()
+    for project_id in os.listdir(u'database'):
+        project_folder = os.path.join(u'database', project_id)
+        if not os.path.isdir(project_folder) or project_id.startswith('.') or project_folder == LOCK_FOLDER:
+            continue
+        projects[project_id] = list()
+        for dir_name in os.listdir(project_folder):
+            if not re.match(r'^v\d+$', dir_name) or not os.path.isdir(os.path.join(project_folder, dir_name)):
+                continue
+            file_names = sorted(filter(__is_model_file, os.listdir(os.path.join(project_folder, dir_name))))
+            if file_names:
+                projects[project_id].append((int(dir_name[1:]), os.path.join(project_folder, dir_name, file_names[0])))
+    return projects
+
+
+def __ensure_index():
+    """
+    Prerequisite:
+        DO NOT use when holding *db.lock* system lock.
+    Synopsis:
+        Builds the project index from the database folder if it does not exist yet,
+        e.g. on the first start after an update of an existing installation.
+        This function claims the *db.lock* system lock if the index has to be built.
+    """
+    if not index.exists():
+        with __database_lock():
+            if not index.exists():
+                index.rebuild(__scan_projects())
+
+
+def rebuild_index():
+    """
+    Synopsis:
+        Rebuilds the project index from the database folder. Use this after the database folder
+        was changed by other means than the SNAPE service.
+        This function claims the *db.lock* system lock exclusively.
+    """
+    with __database_lock():
+        index.rebuild(__scan_projects())
+
+
+def compress_revisions():
+    """
+    Synopsis:
+        Compresses all uncompressed revisions of all projects, e.g. after enabling COMPRESS_REVISIONS.
+        Each project is compressed while holding its lock exclusively.
+        This function claims the *db.lock* system lock shared and the locks of all projects.
+    :returns compressed_count: number of compressed revisions
+    :returns original_size: bytes of the revisions before compression
+    :returns compressed_size: bytes of the revisions after compression
+    """
+    compressed_count = original_size = compressed_size = 0
+    for project_id, revisions in sorted(__scan_projects().iteritems()):
+        with __project_lock(project_id, exclusive = True):
+            blob_folder = os.path.join('database', project_id, BLOB_FOLDER)
+            digests = dict((revision[0], revision[5]) for revision in index.get_revisions(project_id))
+            for revision_id, path in revisions:
+                if storage.is_compressed(path):
+                    continue
+                original_size += os.path.getsize(path)
+                digest = digests.get(revision_id) or storage.content_digest(path)
+                path = storage.compress_revision(path)
+                storage.share_revision(path, blob_folder, digest)
+                compressed_size += os.path.getsize(path)
+                compressed_count += 1
+                index.add_revision(project_id, revision_id, path, digest)
+            storage.remove_unshared_blobs(blob_folder)
+    return compressed_count, original_size, compressed_size
+
+
 def check_project_exists(project_id):
     """
     Synopsis:
         Checks database for a project with the given ID, and returns the result.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock shared.
     :param project_id: ID of the project to be searched
     :returns project_found: boolean
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        try:
-            for roots, dirs, files in os.walk(r'database', topdown = False):
-                if __secure_foldername(unicode(project_id)) in dirs:
-                    return True
-            return False
-        except OSError:
-            traceback.print_exc()
-            raise OSError
+    __ensure_index()
+    with __locked(os.path.join('database', 'db.lock'), exclusive = False):
+        return index.project_exists(__secure_foldername(unicode(project_id)))
 
 
 def check_revision_exits(project_id, revision_id):
     """
     Synopsis:
         Checks database project folder for a revision with the given ID, and returns the result.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock and the lock of the project shared.
     :param project_id: ID of the project to be searched
     :param revision_id: ID of the revision to be searched for
     :returns revision_found: boolean
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        try:
-            for roots, dirs, files in os.walk(os.path.join('database', __secure_foldername(unicode(project_id))),
-                                              topdown = False):
-                if __secure_filename('v' + unicode(revision_id)) in dirs:
-                    return True
-            return False
-        except OSError:
-            traceback.print_exc()
-            raise OSError
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        return index.revision_exists(project_id, revision_id)
 
 
 def get_folder_size(root = '.'):
     """
     Synopsis:
         Checks database for the size of a folder.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock shared.
     :param root: path of folder to be checked.
     :returns total_size: integer
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
+    with __locked(os.path.join('database', 'db.lock'), exclusive = False):
         total_size = 0
         for dirpath, dirnames, filenames in os.walk(root):
             for f in filenames:
@@ -139,62 +267,32 @@ def get_project_models(project_id):
     """
     Synopsis:
         Returns the relative paths to the model files of a given project.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock and the lock of the project shared.
     :param project_id: ID of the project to be searched
     :returns mdj_files: list of strings
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-
-        mdj_files = []
-        try:
-            for roots, dirs, files in os.walk(os.path.join('database', __secure_foldername(unicode(project_id))),
-                                              topdown = False):
-                for dir_name in __natural_sort(dirs):
-                    if dir_name not in ['cache', 'statistics']:
-                        for r, d, f in os.walk(os.path.join('database', __secure_foldername(unicode(project_id)),
-                                                            dir_name), topdown = False):
-                            for file_name in f:
-                                mdj_files.append(os.path.join('database', __secure_foldername(unicode(project_id)),
-                                                              dir_name, file_name))
-        except OSError:
-            traceback.print_exc()
-            raise OSError
-
-        return mdj_files
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        return [revision[2] for revision in index.get_revisions(project_id)]
 
 
 def get_project_info(project_id):
     """
     Synopsis:
         Returns information about a projects revisions.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock and the lock of the project shared.
     :param project_id: ID of the project to be searched
     :returns ids: list of revision IDs
     :returns model_metadata: dictionary with revisions as keys and
-        triples (file name, file size, file creation time) as values
+        triples (file name, file size, upload time) as values
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
         ids = list()
         model_metadata = dict()
-        try:
-            for roots, dirs, files in os.walk(os.path.join('database', __secure_foldername(unicode(project_id))),
-                                              topdown = False):
-                for dir_name in __natural_sort(dirs):
-                    try:
-                        ids.append(int(dir_name[1:]))
-                        for r, d, f in os.walk(os.path.join('database', __secure_foldername(unicode(project_id)),
-                                                            dir_name), topdown = False):
-                            file_time = time.ctime(os.path.getmtime(r + os.path.sep + f[0]))
-                            file_size_kb = str(os.stat(r + os.path.sep + f[0]).st_size // 1024 + 1) + 'KB'
-                            model_metadata[int(dir_name[1:])] = (f[0], file_size_kb, file_time)
-                            break
-                    except Exception:
-                        pass
-        except OSError:
-            traceback.print_exc()
-            raise OSError
+        for revision_id, file_name, path, size, mtime, sha1 in index.get_revisions(project_id):
+            ids.append(revision_id)
+            model_metadata[revision_id] = (file_name, str(size // 1024 + 1) + 'KB', time.ctime(mtime))
 
         return ids, model_metadata
 
@@ -203,86 +301,130 @@ def create_project(project_id):
     """
     Synopsis:
         Creates a new database folder for a project with the given ID.
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock exclusively.
     :param project_id: ID of the project to be created
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
+    __ensure_index()
+    with __database_lock():
         if type(project_id) is not unicode:
             project_id = unicode(project_id)
         project_id = __secure_foldername(project_id)
         if not os.path.exists(os.path.join('database', __secure_foldername(unicode(project_id)))):
             os.makedirs(os.path.join('database', __secure_foldername(unicode(project_id))))
+        index.add_project(project_id)
 
 
 def delete_project(project_id):
     """
     Synopsis:
         Deletes a database folder of the project with the given ID
-        This function claims the *db.lock* system lock.
+        The folder is moved aside while holding the lock and deleted afterwards, so the lock is only held briefly.
+        This function claims the *db.lock* system lock exclusively.
     :param project_id: ID of the project to be deleted
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        project_id = __secure_foldername(unicode(project_id))
-        for root, dirs, files in os.walk(os.path.join('database', __secure_foldername(unicode(project_id))),
-                                         topdown = False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-            for name in dirs:
-                os.rmdir(os.path.join(root, name))
+    project_id = __secure_foldername(unicode(project_id))
+    __ensure_index()
+    with __database_lock():
+        deleted_folder = tempfile.mkdtemp(prefix = '.deleted_', dir = 'database')
+        os.rename(os.path.join('database', project_id), deleted_folder)  # replaces the empty folder
+        index.remove_project(project_id)
+    # the lock file of the project is kept, as other requests may still wait for it
+    rmtree(deleted_folder)
+
+
+def create_upload(project_id, stream, filename):
+    """
+    Synopsis:
+        Streams an uploaded model file into a new upload folder inside the project folder, in chunks of
+        UPLOAD_CHUNK_SIZE bytes and compressed if COMPRESS_REVISIONS is set.
+        Every upload gets its own folder, so concurrent uploads do not interfere.
+        The folder either becomes a revision by add_revision or is removed by discard_upload.
+    :param project_id: ID of the project
+    :param stream: file-like object of the uploaded file
+    :param filename: name of the uploaded file
+    :returns model_path: path of the written .mdj file
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    upload_folder = tempfile.mkdtemp(prefix = '.upload_', dir = os.path.join('database', project_id))
+    try:
+        model_path = storage.write_revision(stream, os.path.join(upload_folder, __secure_filename(filename)))
+    except (IOError, OSError):
+        rmtree(upload_folder, ignore_errors = True)
+        raise
+    return model_path
+
 
-        os.rmdir(os.path.join('database', __secure_foldername(unicode(project_id))))
+def discard_upload(model_path):
+    """
+    Synopsis:
+        Removes the upload folder of a model file created by create_upload, unless it became a revision.
+    :param model_path: path returned by create_upload
+    """
+    if os.path.isdir(os.path.dirname(model_path)):
+        rmtree(os.path.dirname(model_path), ignore_errors = True)
 
 
-def add_revision(project_id, model_file, filename = None):
+def add_revision(project_id, model_path):
     """
     Synopsis:
-        Adds a new revision to the project database folder with the given ID.
-        This function claims the *db.lock* system lock.
+        Adds an uploaded model file as new revision to the project database folder with the given ID.
+        The upload folder is renamed into place, so the revision appears atomically and is not copied.
+        With DELTA_SNAPSHOT_INTERVAL the revision is then stored as delta against the latest revision,
+        otherwise it shares its file with the revisions of the project that have the same content.
+        This function claims the *db.lock* system lock shared and the lock of the project exclusively.
     :param project_id: ID of the project
-    :param model_file: file to be saved
-    :param filename: if provided, this is used internally instead of the files name attribute
+    :param model_path: path of the model file returned by create_upload
     :returns version_number: integer
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        project_id = __secure_foldername(unicode(project_id))
-        version_number = 1
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id, exclusive = True):
+        version_number = index.next_revision_id(project_id)
+        revision_folder = os.path.join('database', project_id, 'v%i' % version_number)
+        os.rename(os.path.dirname(model_path), revision_folder)
+        path = os.path.join(revision_folder, os.path.basename(model_path))
+        upload_time = os.path.getmtime(path)
+        digest = storage.content_digest(path)
+        revisions = index.get_revisions(project_id)
+        if DELTA_SNAPSHOT_INTERVAL > 0 and revisions:
+            path = storage.encode_delta(path, revisions[-1][2])
+        storage.share_revision(path, os.path.join('database', project_id, BLOB_FOLDER), digest)
+        index.add_revision(project_id, version_number, path, digest, upload_time)
+        return version_number
 
-        for root, dirs, files in os.walk(os.path.join('database', __secure_foldername(unicode(project_id))),
-                                         topdown = False):
-            for name in dirs:
-                if name not in ['cache', 'statistics'] and int(name[1:]) >= version_number:
-                    version_number = int(name[1:]) + 1
 
-        try:
-            os.makedirs(os.path.join('database', project_id, 'v%i' % version_number))
-            os.chdir(os.path.join('database', project_id, 'v%i' % version_number))
-            if filename:
-                file_obj = codecs.open(__secure_filename(filename), 'w')
-                for line in model_file:
-                    file_obj.write(line)
-                file_obj.close()
-            else:
-                model_file.save(os.path.join(os.path.join('database', project_id, 'v%i' % version_number),
-                                             __secure_filename(model_file.filename.encode('utf-8'))))
-        finally:
-            os.chdir(ROOT)
-        return version_number
+def get_latest_revision(project_id):
+    """
+    Synopsis:
+        Returns the ID and the content digest of the latest revision of a project.
+        This function claims the *db.lock* system lock and the lock of the project shared.
+    :param project_id: ID of the project
+    :returns revision: (revision ID, content digest) tuple, or None if the project has no revisions
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        revisions = index.get_revisions(project_id)
+        return (revisions[-1][0], revisions[-1][5]) if revisions else None
 
 
 def delete_revision(project_id, version_number):
     """
     Synopsis:
         Removes a revision with the given version number from the database folder of the specified project.
-        This function claims the *db.lock* system lock.
+        A delta that is based on the revision is replaced by its complete revision beforehand, which is shared
+        like any other complete revision, and the file of the revision is removed once no other revision shares it.
+        This function claims the *db.lock* system lock shared and the lock of the project exclusively.
     :param project_id: ID of the project
     :param version_number: ID of the revision to be deleted
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        project_id = __secure_foldername(unicode(project_id))
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id, exclusive = True):
+        blob_folder = os.path.join('database', project_id, BLOB_FOLDER)
+        for revision_id, file_name, path, size, mtime, sha1 in index.get_revisions(project_id):
+            if storage.get_base_folder(path) == 'v%i' % version_number:
+                path = storage.materialize(path)
+                storage.share_revision(path, blob_folder, sha1)
+                index.add_revision(project_id, revision_id, path, sha1)
+
         for root, dirs, files in os.walk(os.path.join('database', project_id, 'v%i' % version_number),
                                          topdown = False):
             for name in files:
@@ -291,19 +433,22 @@ def delete_revision(project_id, version_number):
                 os.rmdir(os.path.join(root, name))
 
         os.rmdir(os.path.join('database', project_id, 'v%i' % version_number))
+        index.remove_revision(project_id, version_number)
+        storage.remove_unshared_blobs(blob_folder)
 
 
-def add_statistics(project_id, stat_files_paths):
+def add_statistics(project_id, stat_files_paths, version = None):
     """
     Synopsis:
         Takes a list of paths to project statistics files and moves them to their proper destination
         inside the project database folder of the specified project.
+        This function claims the *db.lock* system lock shared and the lock of the project exclusively.
     :param project_id: ID of the project
     :param stat_files_paths: list of paths to the statistics files to be transferred to a project
+    :param version: string identifying the revisions the statistics were generated from, see get_statistics_version
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        project_id = __secure_foldername(unicode(project_id))
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id, exclusive = True):
 
         if not os.path.isdir(os.path.join('database', project_id, 'statistics')):
             os.mkdir(os.path.join('database', project_id, 'statistics'))
@@ -311,19 +456,91 @@ def add_statistics(project_id, stat_files_paths):
             if os.path.isfile(os.path.join('database', project_id, 'statistics', os.path.split(path)[-1])):
                 os.remove(os.path.join('database', project_id, 'statistics', os.path.split(path)[-1]))
             os.rename(path, os.path.join('database', project_id, 'statistics', os.path.split(path)[-1]))
+        if version is not None:
+            with open(os.path.join('database', project_id, 'statistics', STATISTICS_VERSION_FILE), 'w') as version_file:
+                version_file.write(version)
+
+
+def get_statistics_version(project_id):
+    """
+    Synopsis:
+        Returns the version that was given to add_statistics along with the current statistics files.
+        This function claims the *db.lock* system lock and the lock of the project shared.
+    :param project_id: ID of the project
+    :returns version: string, or None if no version has been stored
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        version_path = os.path.join('database', project_id, 'statistics', STATISTICS_VERSION_FILE)
+        if not os.path.isfile(version_path):
+            return None
+        with open(version_path, 'r') as version_file:
+            return version_file.read()
+
+
+def get_revision_digests(project_id):
+    """
+    Synopsis:
+        Returns the revisions of a given project together with their model files and content digests.
+        This function claims the *db.lock* system lock and the lock of the project shared.
+    :param project_id: ID of the project to be searched
+    :returns revisions: list of (revision ID, path to .mdj file, content digest) tuples, ordered by revision ID
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        return [(revision[0], revision[2], revision[5]) for revision in index.get_revisions(project_id)]
+
+
+def get_statistics_data(project_id):
+    """
+    Synopsis:
+        Returns the statistics data points stored for a project by set_statistics_data.
+        This function claims the *db.lock* system lock and the lock of the project shared.
+    :param project_id: ID of the project
+    :returns data: dictionary, empty if no data has been stored
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
+        data_path = os.path.join('database', project_id, 'statistics', STATISTICS_DATA_FILE)
+        if not os.path.isfile(data_path):
+            return dict()
+        try:
+            with open(data_path, 'rb') as data_file:
+                return json.load(data_file)
+        except ValueError:
+            traceback.print_exc()
+            return dict()
+
+
+def set_statistics_data(project_id, data):
+    """
+    Synopsis:
+        Replaces the statistics data points stored for a project.
+        This function claims the *db.lock* system lock shared and the lock of the project exclusively.
+    :param project_id: ID of the project
+    :param data: dictionary that can be encoded as JSON
+    """
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id, exclusive = True):
+        statistics_folder = os.path.join('database', project_id, 'statistics')
+        if not os.path.isdir(statistics_folder):
+            os.mkdir(statistics_folder)
+        temp_path = os.path.join(statistics_folder, '.%s.%i.tmp' % (STATISTICS_DATA_FILE, os.getpid()))
+        with open(temp_path, 'wb') as data_file:
+            json.dump(data, data_file)
+        os.rename(temp_path, os.path.join(statistics_folder, STATISTICS_DATA_FILE))
 
 
 def get_project_statistics(project_id):
     """
     Synopsis:
         Returns a list of paths to all statistics files of a given project
-        This function claims the *db.lock* system lock.
+        This function claims the *db.lock* system lock and the lock of the project shared.
     :param project_id: ID of the project to be searched
     :returns statistics_paths: list of strings
     """
-    with open(os.path.join('database', 'db.lock'), 'a', 0) as db_lock:
-        plocker.lock(db_lock, plocker.LOCK_EX)
-        project_id = __secure_foldername(unicode(project_id))
+    project_id = __secure_foldername(unicode(project_id))
+    with __project_lock(project_id):
 
         statistics_paths = list()
 
@@ -337,62 +554,202 @@ def get_project_statistics(project_id):
         return statistics_paths
 
 
-def invalidate_cache(project_id):
+def retire_outdated_caches(project_id, mdjs, versions):
     """
     Synopsis:
-        Deletes the cache of a database project folder.
-        This function claims the *cache.lock* system lock.
-    :param project_id: ID of the project to be searched
+        Removes all cached versions of the given diagrams except their current one. Nothing is removed if
+        the revisions of the project changed since the versions were determined.
+        Versions are moved aside while holding the lock and deleted afterwards, so the lock is only held briefly.
+        This function claims the *db.lock* system lock, the lock of the project and the cache lock of each diagram.
+    :param project_id: ID of the project
+    :param mdjs: list of paths to the .mdj files the versions were determined for
+    :param versions: dictionary of the IDs of the diagrams whose caches are retired and their current cache versions,
+        as returned by timeslice_store.get_cache_version
+    """
+    cache_folder = os.path.join('database', project_id, 'cache')
+    if not os.path.isdir(cache_folder):
+        return
+    outdated = list()
+    for diagram_id in os.listdir(cache_folder):
+        if diagram_id.startswith('.') or diagram_id not in versions:
+            continue
+        with lock_diagram_cache(project_id, diagram_id):
+            if not os.path.isdir(os.path.join(cache_folder, diagram_id)) or \
+                    get_project_models(project_id = project_id) != mdjs:
+                continue
+            version = versions[diagram_id]
+            for entry in os.listdir(os.path.join(cache_folder, diagram_id)):
+                if entry in (version, version + '.partial'):
+                    continue
+                outdated.append(tempfile.mkdtemp(prefix = '.outdated_', dir = cache_folder))
+                os.rename(os.path.join(cache_folder, diagram_id, entry), outdated[-1])  # replaces the empty folder
+            if not os.listdir(os.path.join(cache_folder, diagram_id)):
+                os.rmdir(os.path.join(cache_folder, diagram_id))
+    for folder_path in outdated:
+        rmtree(folder_path, ignore_errors = True)
+
+
+@contextmanager
+def lock_diagram_cache(project_id, diagram_id):
     """
-    with open('cache.lock', 'a', 0) as cache_lock:
-        plocker.lock(cache_lock, plocker.LOCK_EX)
-        if os.path.isdir(os.path.join('database', project_id, 'cache')):
-            rmtree(os.path.join('database', project_id, 'cache'))
+    Synopsis:
+        Claims the cache lock of a diagram for the duration of a with-block. It is held while looking up,
+        storing or removing cached frames of the diagram, but never while rendering.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    """
+    with __locked(__lock_path('%s.%s.cache' % (__secure_foldername(unicode(project_id)),
+                                               __secure_foldername(unicode(diagram_id)))), exclusive = True):
+        yield
 
 
-def build_cache(project_id, diagram_id):
+@contextmanager
+def lock_diagram_render(project_id, diagram_id):
+    """
+    Synopsis:
+        Claims the render lock of a diagram for the duration of a with-block. Requests that find a frame
+        of the diagram missing in the cache render it while holding this lock, so concurrent requests
+        for the same diagram wait for a single render and then find the frame in the cache.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    """
+    with __locked(__lock_path('%s.%s.render' % (__secure_foldername(unicode(project_id)),
+                                                __secure_foldername(unicode(diagram_id)))), exclusive = True):
+        yield
+
+
+def create_render_workspace(project_id):
+    """
+    Synopsis:
+        Creates an empty folder in which images of a project can be rendered without interfering with other renders.
+        The folder is located inside the project cache, so it can be moved into the cache atomically.
+    :param project_id: ID of the project
+    :returns workspace: path of the created folder
+    """
+    cache_folder = os.path.join('database', project_id, 'cache')
+    try:
+        os.makedirs(cache_folder)
+    except OSError:
+        if not os.path.isdir(cache_folder):
+            raise
+    return tempfile.mkdtemp(prefix = '.render_', dir = cache_folder)
+
+
+def build_cache(project_id, diagram_id, version, workspace):
     """
     Prerequisite:
-        Project has been rendered into root.
-        Only use when holding *cache.lock* system lock.
+        Project has been rendered into the given workspace.
+        Only use when holding the cache lock of the diagram.
     Synopsis:
-        Builds a projects cache and removes rendered images from root.
-        This function claims the *db.lock* system lock.
+        Builds a projects cache by moving the workspace into place as the given version of the diagram cache.
+        If this version has been cached in the meantime, the workspace is discarded instead.
+        Frames of this version that were rendered on demand are discarded.
     :param project_id: ID of the project to be searched
     :param diagram_id: ID of the diagram used for rendering
+    :param version: cache version of the revisions the workspace was rendered from
+    :param workspace: folder created by create_render_workspace
     """
-    os.makedirs(os.path.join('database', project_id, 'cache', diagram_id))
-    for file_name in os.listdir('./'):
-        if file_name.startswith('dfv_') and file_name.endswith('.png'):
-            os.rename(file_name, os.path.join('database', project_id, 'cache',
-                                              diagram_id, file_name))
-        elif file_name.startswith('temp_dot_file') and file_name.endswith('.txt'):
-            os.rename(file_name, os.path.join('database', project_id, 'cache',
-                                              diagram_id,
-                                              file_name.replace('temp_dot_file', 'graph')
-                                              .replace('txt', 'dot')))
+    for file_name in os.listdir(workspace):
+        if file_name.startswith('temp_dot_file') and file_name.endswith('.txt'):
+            os.rename(os.path.join(workspace, file_name),
+                      os.path.join(workspace, file_name.replace('temp_dot_file', 'graph').replace('txt', 'dot')))
+
+    cache_folder = os.path.join('database', project_id, 'cache', diagram_id, version)
+    if os.path.isdir(cache_folder):
+        rmtree(workspace)
+    else:
+        if not os.path.isdir(os.path.dirname(cache_folder)):
+            os.makedirs(os.path.dirname(cache_folder))
+        os.rename(workspace, cache_folder)
 
+    if os.path.isdir(get_partial_cache_folder(project_id, diagram_id, version)):
+        rmtree(get_partial_cache_folder(project_id, diagram_id, version))
 
-def get_cache_filepath(frame, project_id, diagram_id):
+
+def add_partial_frame(project_id, diagram_id, version, frame_file):
     """
     Prerequisite:
-        Only use when holding *cache.lock* system lock. DO NOT LOCK CACHE HERE.
+        Only use when holding the cache lock of the diagram.
+    Synopsis:
+        Moves a frame that was rendered on demand into the partial cache of a diagram.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram used for rendering
+    :param version: cache version of the revisions the frame was rendered from
+    :param frame_file: path of the rendered frame inside a render workspace
+    :returns frame_path: path of the frame inside the partial cache
+    """
+    partial_folder = get_partial_cache_folder(project_id, diagram_id, version)
+    if not os.path.isdir(partial_folder):
+        os.makedirs(partial_folder)
+    frame_path = os.path.join(partial_folder, os.path.basename(frame_file))
+    os.rename(frame_file, frame_path)
+    return frame_path
+
+
+def get_timeslice_store_folder(project_id):
+    """
+    Synopsis:
+        Returns the path of the folder which holds the persisted timeslices of a project.
+        The folder is created if it does not exist yet.
+    :param project_id: ID of the project
+    :returns folder_path: string
+    """
+    folder_path = os.path.join('database', __secure_foldername(unicode(project_id)), 'timeslices')
+    try:
+        os.makedirs(folder_path)
+    except OSError:
+        if not os.path.isdir(folder_path):
+            raise
+    return folder_path
+
+
+def get_partial_cache_folder(project_id, diagram_id, version):
+    """
+    Synopsis:
+        Returns the path of the folder which holds frames of a diagram that were rendered on demand,
+        while the complete history of the diagram has not been cached yet.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram used for rendering
+    :param version: cache version of the revisions the frames were rendered from
+    :returns folder_path: string
+    """
+    return os.path.join('database', project_id, 'cache', diagram_id, version + '.partial')
+
+
+def get_cache_filepath(frame, project_id, diagram_id, version, partial = False):
+    """
+    Prerequisite:
+        Only use when holding the cache lock of the diagram. DO NOT LOCK CACHE HERE.
     Synopsis:
         Returns path of cached render (subject to the given diagram_id) for the given frame of a project.
     :param project_id: ID of the project to be searched
     :param frame: frame index to be returned
     :param diagram_id: ID of the diagram used for rendering
+    :param version: cache version of the diagram, as returned by timeslice_store.get_cache_version
+    :param partial: if True, frames that were rendered on demand are searched instead of the complete cache
     :returns revision_found: boolean
     """
-    if os.path.isdir(os.path.join('database', project_id, 'cache', diagram_id)):
+    if partial:
+        folder_path = get_partial_cache_folder(project_id, diagram_id, version)
+    else:
+        folder_path = os.path.join('database', project_id, 'cache', diagram_id, version)
+    if os.path.isdir(folder_path):
         pad_h = '' if frame // 100 != 0 or frame > 999 else '0'
         pad_t = '' if frame // 10 != 0 or frame > 999 else '0'
-        framepath = os.path.join('database', project_id, 'cache', diagram_id,
-                                 'dfv_%s%s%i.png' % (pad_h, pad_t, frame))
+        framepath = os.path.join(folder_path, 'dfv_%s%s%i.png' % (pad_h, pad_t, frame))
         if os.path.isfile(framepath):
             return framepath
     return ''
 
 
 if __name__ == '__main__':
-    pass
+    import sys
+    if sys.argv[1:] == ['rebuild-index']:
+        os.chdir(ROOT)
+        rebuild_index()
+    elif sys.argv[1:] == ['compress-revisions']:
+        os.chdir(ROOT)
+        count, before, after = compress_revisions()
+        print 'Compressed %i revisions from %i to %i bytes' % (count, before, after)
+    else:
+        print 'Usage: project_database.py rebuild-index | compress-revisions'
@@ -0,0 +1,243 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+The project index keeps the metadata of all projects and revisions of the database in a SQLite file, so that
+lookups do not need to walk the database folder. It is only kept in sync by the project_database, which holds
+the lock of a project (or the *db.lock* system lock for whole projects) while changing the folder and the index,
+and can be rebuilt from the folder at any time.
+"""
+
+import os
+import sqlite3
+import revision_storage as storage
+from contextlib import closing
+
+INDEX_FILE = os.path.join('database', 'index.sqlite')
+
+__SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects (
+    project_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    project_id TEXT NOT NULL REFERENCES projects(project_id) ON DELETE CASCADE,
+    revision_id INTEGER NOT NULL,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,  -- upload time of the revision, shared revision files carry the time of the first upload
+    sha1 TEXT NOT NULL,  -- digest of the model, see revision_storage.content_digest
+    PRIMARY KEY (project_id, revision_id)
+);
+'''
+
+
+def __connect():
+    """
+    Prerequisite:
+        The index has been created, see rebuild.
+    Synopsis:
+        Opens a connection to the index.
+        Used as context manager, a connection commits on success and rolls back on errors.
+    :returns connection: sqlite3 connection
+    """
+    connection = sqlite3.connect(INDEX_FILE, timeout = 30)
+    connection.execute('PRAGMA foreign_keys = ON')
+    return connection
+
+
+def __revision_row(project_id, revision_id, path, digest = None, upload_time = None):
+    """
+    Synopsis:
+        Collects the metadata of a revision file.
+    :param project_id: ID of the project
+    :param revision_id: ID of the revision
+    :param path: path to the .mdj file of the revision
+    :param digest: content digest of the revision, computed if not given
+    :param upload_time: upload time of the revision, the modification time of the file if not given
+    :returns row: tuple matching the columns of the revisions table
+    """
+    if digest is None:
+        digest = storage.content_digest(path)
+    stat = os.stat(path)
+    if upload_time is None:
+        upload_time = stat.st_mtime
+    return (unicode(project_id), revision_id, storage.model_name(path), unicode(path), stat.st_size, upload_time,
+            digest)
+
+
+def __upload_times(connection):
+    """
+    Synopsis:
+        Returns the upload times of all indexed revisions.
+    :param connection: sqlite3 connection
+    :returns upload_times: dictionary of (project ID, revision ID) tuples and upload times
+    """
+    return dict(((project_id, revision_id), mtime) for project_id, revision_id, mtime in
+                connection.execute('SELECT project_id, revision_id, mtime FROM revisions'))
+
+
+def exists():
+    """
+    Synopsis:
+        Checks whether the index has been created.
+    :returns index_found: boolean
+    """
+    return os.path.isfile(INDEX_FILE)
+
+
+def add_project(project_id):
+    """
+    Synopsis:
+        Adds a project to the index. Adding an indexed project has no effect.
+    :param project_id: ID of the project
+    """
+    with closing(__connect()) as connection:
+        with connection:
+            connection.execute('INSERT OR IGNORE INTO projects VALUES (?)', (unicode(project_id),))
+
+
+def remove_project(project_id):
+    """
+    Synopsis:
+        Removes a project and all its revisions from the index.
+    :param project_id: ID of the project
+    """
+    with closing(__connect()) as connection:
+        with connection:
+            connection.execute('DELETE FROM projects WHERE project_id = ?', (unicode(project_id),))
+
+
+def project_exists(project_id):
+    """
+    Synopsis:
+        Checks whether a project is indexed.
+    :param project_id: ID of the project
+    :returns project_found: boolean
+    """
+    with closing(__connect()) as connection:
+        return connection.execute('SELECT 1 FROM projects WHERE project_id = ?',
+                                  (unicode(project_id),)).fetchone() is not None
+
+
+def add_revision(project_id, revision_id, path, digest = None, upload_time = None):
+    """
+    Synopsis:
+        Adds a revision file to the index. The project is added if it is not indexed yet.
+        A revision that is indexed already, e.g. after its file was compressed, keeps its upload time.
+    :param project_id: ID of the project
+    :param revision_id: ID of the revision
+    :param path: path to the .mdj file of the revision
+    :param digest: content digest of the revision, computed if not given
+    :param upload_time: upload time of the revision, see __revision_row
+    """
+    with closing(__connect()) as connection:
+        if upload_time is None:
+            upload_time = connection.execute('SELECT mtime FROM revisions WHERE project_id = ? AND revision_id = ?',
+                                             (unicode(project_id), revision_id)).fetchone()
+            upload_time = upload_time[0] if upload_time else None
+        row = __revision_row(project_id, revision_id, path, digest, upload_time)
+        with connection:
+            connection.execute('INSERT OR IGNORE INTO projects VALUES (?)', (unicode(project_id),))
+            connection.execute('INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+
+
+def remove_revision(project_id, revision_id):
+    """
+    Synopsis:
+        Removes a revision from the index.
+    :param project_id: ID of the project
+    :param revision_id: ID of the revision
+    """
+    with closing(__connect()) as connection:
+        with connection:
+            connection.execute('DELETE FROM revisions WHERE project_id = ? AND revision_id = ?',
+                               (unicode(project_id), revision_id))
+
+
+def revision_exists(project_id, revision_id):
+    """
+    Synopsis:
+        Checks whether a revision is indexed.
+    :param project_id: ID of the project
+    :param revision_id: ID of the revision
+    :returns revision_found: boolean
+    """
+    with closing(__connect()) as connection:
+        return connection.execute('SELECT 1 FROM revisions WHERE project_id = ? AND revision_id = ?',
+                                  (unicode(project_id), revision_id)).fetchone() is not None
+
+
+def next_revision_id(project_id):
+    """
+    Synopsis:
+        Returns the ID the next revision of a project is stored with, i.e. the highest revision ID plus one.
+    :param project_id: ID of the project
+    :returns revision_id: integer
+    """
+    with closing(__connect()) as connection:
+        highest = connection.execute('SELECT MAX(revision_id) FROM revisions WHERE project_id = ?',
+                                     (unicode(project_id),)).fetchone()[0]
+    return (highest or 0) + 1
+
+
+def get_revisions(project_id):
+    """
+    Synopsis:
+        Returns the metadata of all revisions of a project, ordered by revision ID.
+    :param project_id: ID of the project
+    :returns revisions: list of (revision ID, file name, path, size, mtime, sha1) tuples
+    """
+    with closing(__connect()) as connection:
+        return connection.execute('SELECT revision_id, file_name, path, size, mtime, sha1 FROM revisions '
+                                  'WHERE project_id = ? ORDER BY revision_id', (unicode(project_id),)).fetchall()
+
+
+def rebuild(projects):
+    """
+    Synopsis:
+        Creates the index, or replaces an existing one. The index is written to a temporary file with its tables
+        and then moved into place, so other processes either see the former index or the complete new one,
+        and connections never need to create the tables. Revisions that are indexed already keep their upload
+        time, the others are indexed with the modification time of their file.
+    :param projects: dictionary of project IDs and lists of (revision ID, path to .mdj file) tuples
+    """
+    upload_times = dict()
+    if exists():
+        with closing(__connect()) as connection:
+            upload_times = __upload_times(connection)
+    rows = list()
+    for project_id, revisions in projects.iteritems():
+        for revision_id, path in revisions:
+            rows.append(__revision_row(project_id, revision_id, path,
+                                       upload_time = upload_times.get((unicode(project_id), revision_id))))
+
+    temp_file = '%s.%i.tmp' % (INDEX_FILE, os.getpid())
+    try:
+        with closing(sqlite3.connect(temp_file)) as connection:
+            connection.executescript(__SCHEMA)
+            with connection:
+                connection.executemany('INSERT INTO projects VALUES (?)', [(unicode(p),) for p in projects])
+                connection.executemany('INSERT INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        os.rename(temp_file, INDEX_FILE)
+    finally:
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
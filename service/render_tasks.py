@@ -0,0 +1,244 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Render tasks maintain the cache of diagram histories in the background. They complete the cache of a diagram
+after get_history has rendered the requested frame on demand, at most one task per (project, diagram, version)
+is pending at any time, and they remove cache versions that were outdated by new or deleted revisions.
+
+Statistics jobs collect the statistics data of a project after its revisions changed. They are run by a pool of
+at most STATISTICS_WORKERS threads, which end once they have been idle for a while. Jobs are coalesced per
+project: while a job is queued, scheduling another one for the same project has no effect, and while a job is
+running, at most one more is queued, so a burst of uploads results in at most two computations.
+"""
+
+import os
+import Queue
+import threading
+import traceback
+from shutil import rmtree
+from config import PRERENDER_HISTORIES, STATISTICS_WORKERS
+import project_database as db
+import graph_animator as anim
+import timeslice_store as slices
+from statistic_collector import update_statistics
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+WORKER_IDLE_TIMEOUT = 5  # seconds a statistics worker waits for a job before it ends
+
+__pending = set()
+__pending_lock = threading.Lock()
+
+__statistics_queue = Queue.Queue()
+__statistics_jobs = dict()  # project ID -> JOB_QUEUED or JOB_RUNNING
+__statistics_requeued = set()  # projects whose running job is to be repeated
+__prerender_diagrams = dict()  # project ID -> set of diagram IDs to be rendered after the statistics
+__worker_count = 0
+
+
+def __render_history(project_id, diagram_id, version, mdjs):
+    """
+    Synopsis:
+        Renders all frames of a diagram history into a render workspace and moves it into the project cache.
+        Nothing is cached if the revisions of the project changed since the task was scheduled.
+        This function claims the *db.lock* and *store.lock* system locks and the cache lock of the diagram.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram to be rendered
+    :param version: cache version of the given .mdj files
+    :param mdjs: list of paths to the .mdj files the task was scheduled for
+    """
+    workspace = None
+    try:
+        timeslice_array, diagram_found, error_flag = slices.get_timeslices(project_id, diagram_id, mdjs)
+        if error_flag or not diagram_found:
+            return
+
+        workspace = db.create_render_workspace(project_id)
+        anim.render_timeslices(timeslice_array = timeslice_array, folder = workspace)
+
+        with db.lock_diagram_cache(project_id, diagram_id):
+            if db.get_project_models(project_id = project_id) == mdjs:
+                db.build_cache(project_id, diagram_id, version, workspace)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        if workspace and os.path.isdir(workspace):
+            rmtree(workspace, ignore_errors = True)
+        with __pending_lock:
+            __pending.discard((project_id, diagram_id, version))
+
+
+def __retire_caches(project_id, diagram_ids):
+    """
+    Synopsis:
+        Removes outdated cache versions of the given diagrams.
+        This function claims the *db.lock* and *store.lock* system locks and the cache locks of the diagrams.
+    :param project_id: ID of the project
+    :param diagram_ids: IDs of the diagrams whose caches are retired
+    """
+    try:
+        mdjs = db.get_project_models(project_id = project_id)
+        versions = dict()
+        for diagram_id in diagram_ids:
+            version, diagram_found, error_flag = slices.get_cache_version(project_id, diagram_id, mdjs)
+            if not error_flag:
+                versions[diagram_id] = version
+        db.retire_outdated_caches(project_id, mdjs, versions)
+    except Exception:
+        traceback.print_exc()
+
+
+def schedule_history_render(project_id, diagram_id, version, mdjs):
+    """
+    Synopsis:
+        Schedules the rendering of the complete history of a diagram in a background thread,
+        unless a task for the same diagram and version is already pending.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram to be rendered
+    :param version: cache version of the given .mdj files
+    :param mdjs: list of paths to the current .mdj files of the project
+    :returns scheduled: True, if a new task was started
+    """
+    with __pending_lock:
+        if (project_id, diagram_id, version) in __pending:
+            return False
+        __pending.add((project_id, diagram_id, version))
+
+    task = threading.Thread(target = __render_history, args = (project_id, diagram_id, version, mdjs))
+    task.daemon = True
+    task.start()
+    return True
+
+
+def schedule_cache_retirement(project_id, diagram_ids):
+    """
+    Synopsis:
+        Schedules the removal of outdated cache versions of the given diagrams in a background thread.
+    :param project_id: ID of the project
+    :param diagram_ids: IDs of the diagrams whose caches are retired
+    """
+    task = threading.Thread(target = __retire_caches, args = (project_id, diagram_ids))
+    task.daemon = True
+    task.start()
+
+
+def __run_statistics_job(project_id):
+    """
+    Synopsis:
+        Collects the statistics data of a project. With PRERENDER_HISTORIES the histories of the diagrams that
+        changed since the last job are rendered into the cache afterwards.
+        This function claims the *db.lock* and *store.lock* system locks and the cache locks of the diagrams.
+    :param project_id: ID of the project
+    """
+    with __pending_lock:
+        diagram_ids = __prerender_diagrams.pop(project_id, set())
+    try:
+        if not db.check_project_exists(project_id = project_id):
+            return
+        update_statistics(project_id)
+        if not diagram_ids:
+            return
+        mdjs = db.get_project_models(project_id = project_id)
+        for diagram_id in sorted(diagram_ids):
+            version, diagram_found, error_flag = slices.get_cache_version(project_id, diagram_id, mdjs)
+            if error_flag or not diagram_found:
+                continue
+            with __pending_lock:
+                if (project_id, diagram_id, version) in __pending:
+                    continue
+                __pending.add((project_id, diagram_id, version))
+            __render_history(project_id, diagram_id, version, mdjs)
+    except Exception:
+        traceback.print_exc()
+
+
+def __statistics_worker():
+    """
+    Synopsis:
+        Runs statistics jobs until the queue has been empty for WORKER_IDLE_TIMEOUT seconds.
+    """
+    global __worker_count
+    while True:
+        try:
+            project_id = __statistics_queue.get(timeout = WORKER_IDLE_TIMEOUT)
+        except Queue.Empty:
+            with __pending_lock:
+                if __statistics_queue.empty():
+                    __worker_count -= 1
+                    return
+            continue
+
+        with __pending_lock:
+            __statistics_jobs[project_id] = JOB_RUNNING
+        try:
+            __run_statistics_job(project_id)
+        finally:
+            with __pending_lock:
+                if project_id in __statistics_requeued:
+                    __statistics_requeued.discard(project_id)
+                    __statistics_jobs[project_id] = JOB_QUEUED
+                    __statistics_queue.put(project_id)
+                else:
+                    del __statistics_jobs[project_id]
+
+
+def schedule_statistics(project_id, diagram_ids = ()):
+    """
+    Synopsis:
+        Schedules the collection of the statistics data of a project, unless a job for the project is queued already.
+        If a job for the project is running, it is repeated once it has finished.
+    :param project_id: ID of the project
+    :param diagram_ids: IDs of the diagrams whose timeslices changed, which are rendered with PRERENDER_HISTORIES
+    :returns scheduled: True, if a new job was queued or the running job is to be repeated
+    """
+    global __worker_count
+    with __pending_lock:
+        if PRERENDER_HISTORIES and diagram_ids:
+            __prerender_diagrams.setdefault(project_id, set()).update(diagram_ids)
+        state = __statistics_jobs.get(project_id)
+        if state == JOB_QUEUED or project_id in __statistics_requeued:
+            return False
+        if state == JOB_RUNNING:
+            __statistics_requeued.add(project_id)
+            return True
+        __statistics_jobs[project_id] = JOB_QUEUED
+        __statistics_queue.put(project_id)
+        if __worker_count < STATISTICS_WORKERS:
+            __worker_count += 1
+            worker = threading.Thread(target = __statistics_worker)
+            worker.daemon = True
+            worker.start()
+    return True
+
+
+def get_statistics_job(project_id):
+    """
+    Synopsis:
+        Returns the state of the statistics job of a project.
+    :param project_id: ID of the project
+    :returns state: JOB_QUEUED, JOB_RUNNING or None if no job is queued or running. A running job that is to be
+        repeated is reported as queued, as its result will be outdated.
+    """
+    with __pending_lock:
+        if project_id in __statistics_requeued:
+            return JOB_QUEUED
+        return __statistics_jobs.get(project_id)
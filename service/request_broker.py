@@ -19,20 +19,26 @@ You should have received a copy of the GNU General Public License
 along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from flask import Flask, request, abort, jsonify, send_file
+from flask import Flask, Response, request, abort, jsonify, send_file
 from flask_cors import CORS
 import project_database as db
 import model_parser as parser
-import diff_analyzer as anal
 import graph_animator as anim
 import textlog_generator as gen
+import timeslice_store as slices
+import render_tasks as tasks
+from libs.gvanim import RenderException
+import token_store as tokens
+import revision_storage as storage
 import datetime
 import time
-from shutil import copyfile
+from shutil import copyfile, rmtree
 from security import *
 import portalocker as plocker
-from statistic_collector import generate_statistics
+import statistic_collector as collector
 import socket
+import traceback
+import shelve
 
 
 app = Flask(__name__)
@@ -78,19 +84,7 @@ def create_project():
         finally:
             c.close()
 
-        token_file = shelve.open('token_list')
-        new_tokens = []
-        try:
-            token_list = token_file['token_list']
-            while len(new_tokens) < int(request.json['token_count']):
-                new_token = generate_token(token_list)
-                new_tokens.append(new_token)
-                token_list.append(new_token)
-            token_file['token_list'] = token_list
-            token_file[str(new_project_id)] = new_tokens
-        finally:
-            token_file.close()
-
+    new_tokens = tokens.add_tokens(new_project_id, int(request.json['token_count']))
     db.create_project(project_id = new_project_id)
 
     return jsonify({'new_project_id': new_project_id,
@@ -106,7 +100,7 @@ def delete_project(project_id):
         Deletes a project inside the system. This includes
         1. the database directory
         2. all tokens registered on the project
-        This function claims the *shelve.lock* and the *db.lock* system locks.
+        This function claims the *db.lock* system lock.
     Status Codes:
         200: successful
         400: password or token count not found in request
@@ -124,14 +118,7 @@ def delete_project(project_id):
     if not db.check_project_exists(project_id = project_id):
         abort(404)  # Not found
     db.delete_project(project_id = project_id)
-
-    with open(os.path.join('shelve.lock'), 'a', 0) as shelve_lock:
-        plocker.lock(shelve_lock, plocker.LOCK_EX)
-        token_file = shelve.open('token_list')
-        try:
-            del token_file[str(project_id)]
-        finally:
-            token_file.close()
+    tokens.remove_project(project_id)
 
     return jsonify({'deleted_project_id': project_id,
                     'return_msg': 'The project with the ID %s has been successfully deleted.' % project_id
@@ -143,7 +130,6 @@ def add_new_tokens(project_id):
     """
     Synopsis:
         Generates new user tokens for a given project.
-        This function claims the *shelve.lock* system lock.
     Status Codes:
         201: successful
         400: password or token count not found in request
@@ -168,21 +154,7 @@ def add_new_tokens(project_id):
     if int(request.json['token_count']) > TOKEN_MAX_REQUEST:
         abort(413)  # Payload too large
 
-    token_file = shelve.open('token_list')
-    new_tokens = []
-
-    with open(os.path.join('shelve.lock'), 'a', 0) as shelve_lock:
-        plocker.lock(shelve_lock, plocker.LOCK_EX)
-        try:
-            token_list = token_file['token_list']
-            while len(new_tokens) < int(request.json['token_count']):
-                new_token = generate_token(token_list)
-                new_tokens.append(new_token)
-                token_list.append(new_token)
-            token_file['token_list'] = token_list
-            token_file[str(project_id)] = token_file[str(project_id)] + new_tokens
-        finally:
-            token_file.close()
+    new_tokens = tokens.add_tokens(project_id, int(request.json['token_count']))
 
     return jsonify({'generated_tokens': new_tokens,
                     'return_msg': '%i new tokens have successfully been added to the '
@@ -195,7 +167,6 @@ def remove_tokens(project_id):
     """
     Synopsis:
         Invalidates user tokens for a given project.
-        This function claims the *shelve.lock* system lock.
     Status Codes:
         200: successful
         400: password or token count not found in request
@@ -212,14 +183,7 @@ def remove_tokens(project_id):
     if not db.check_project_exists(project_id = project_id):
         abort(404)  # Not found
 
-    with open(os.path.join('shelve.lock'), 'a', 0) as shelve_lock:
-        plocker.lock(shelve_lock, plocker.LOCK_EX)
-        token_file = shelve.open('token_list')
-        try:
-            token_file[str(project_id)] = filter(lambda x: x not in request.json['tokens_to_delete'],
-                                                 token_file[str(project_id)])
-        finally:
-            token_file.close()
+    tokens.remove_tokens(project_id, request.json['tokens_to_delete'])
 
     return jsonify({'return_msg': 'The tokens have successfully been deleted from the '
                                   'project with the ID %s.' % project_id
@@ -231,11 +195,18 @@ def create_new_revision(project_id, token):
     """
     Synopsis:
         Checks in a new model revision into a given project.
-        The model is saved as new file in the database.
-        The project statistics are updated.
-        This operation invalidates the project cache.
-        This function claims the *db.lock* and *cache.lock* system locks.
+        The uploaded file is streamed into an upload folder of the project, validated there and then
+        moved into place as new revision, so it is written to disk once and not collected in memory.
+        Validation scans the file for a diagram before decoding it, and records the diagram catalog
+        of the revision without building an object tree.
+        The timeslice store is updated.
+        Cache versions of the diagrams whose timeslices changed are retired in the background,
+        and the statistics data of the project is collected by a background job.
+        With SKIP_UNCHANGED_UPLOADS a model identical to the latest revision is not added,
+        and caches and statistics are left untouched.
+        This function claims the *db.lock* and *store.lock* system locks.
     Status Codes:
+        200: model identical to the latest revision, no revision added
         201: successful
         400: password or token count not found in request
         403: password invalid
@@ -255,41 +226,40 @@ def create_new_revision(project_id, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
-    model_file = None
-    unicode_filename = ''
-
     if request.files and request.files['file'] and request.form['filename']:
-        model_file = list()
-        for line in request.files['file'].stream:
-            model_file.append(line)
         escaped_filename = request.form['filename'].encode('utf-8')
         unescaped_filename = escaped_filename.decode('string-escape')
         unicode_filename = unescaped_filename.decode('utf-8')
     else:
         abort(400)  # Bad request
 
-    if model_file is None or not allowed_file(unicode_filename):
+    if not allowed_file(unicode_filename):
         abort(415)  # Unsupported Media Type
 
-    db.invalidate_cache(project_id)
-
-    db.add_revision(project_id = 'temp', model_file = model_file, filename = unicode_filename)
-    new_version_number = -1
-    mdjs = db.get_project_models(project_id = 'temp')
-
-    parsed = parser.parse_models(mdj_array = mdjs)
-    db.delete_project('temp')
-    if len(anal.get_diagram_names_and_ids(parsed)) == 0:
-        abort(422)  # Unprocessable Entity
-
-    else:
-        new_version_number = db.add_revision(project_id = project_id, model_file = model_file,
-                                             filename = unicode_filename)
-
-    generate_statistics(project_id)
+    model_path = db.create_upload(project_id = project_id, stream = request.files['file'].stream,
+                                  filename = unicode_filename)
+    try:
+        if SKIP_UNCHANGED_UPLOADS:
+            latest_revision = db.get_latest_revision(project_id = project_id)
+            if latest_revision and latest_revision[1] == storage.content_digest(model_path):
+                return jsonify({'new_revision_id': latest_revision[0],
+                                'project_id': project_id,
+                                'return_msg': 'The model is identical to the revision numbered %i, '
+                                              'no revision has been added to the project with the ID %s'
+                                              % (latest_revision[0], project_id)
+                                }), 200  # OK
+        if not parser.contains_diagram(model_path) or not parser.get_catalog(model_path):
+            abort(422)  # Unprocessable Entity
+        new_version_number = db.add_revision(project_id = project_id, model_path = model_path)
+    finally:
+        db.discard_upload(model_path)
+
+    changed_diagrams = slices.update_project(project_id)
+    tasks.schedule_cache_retirement(project_id, changed_diagrams)
+    tasks.schedule_statistics(project_id, changed_diagrams)
 
     return jsonify({'new_revision_id': new_version_number,
                     'project_id': project_id,
@@ -303,9 +273,10 @@ def delete_revision(project_id, revision_id, token):
     """
     Synopsis:
         Deletes a checked in model from a given project.
-        The project statistics are updated.
-        This operation invalidates the project cache.
-        This function claims the *db.lock* and *cache.lock* system locks.
+        The timeslice store is updated.
+        Cache versions of the diagrams whose timeslices changed are retired in the background,
+        and the statistics data of the project is collected by a background job.
+        This function claims the *db.lock* and *store.lock* system locks.
     Status Codes:
         200: successful
         400: password or token count not found in request
@@ -322,17 +293,18 @@ def delete_revision(project_id, revision_id, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id = project_id) or \
             not db.check_revision_exits(project_id = project_id, revision_id = revision_id):
         abort(404)  # Not found
 
-    db.invalidate_cache(project_id)
     db.delete_revision(project_id = project_id, version_number = revision_id)
 
-    generate_statistics(project_id)
+    changed_diagrams = slices.update_project(project_id)
+    tasks.schedule_cache_retirement(project_id, changed_diagrams)
+    tasks.schedule_statistics(project_id, changed_diagrams)
 
     return jsonify({'deleted_revision_id': revision_id,
                     'project_id': project_id,
@@ -346,6 +318,7 @@ def get_diagrams(project_id, token):
     """
     Synopsis:
         Collects and returns the diagram IDs contained in a project.
+        The diagrams are taken from the diagram catalogs of the revisions, so no model is parsed.
     Status Codes:
         200: successful
         400: password or token count not found in request
@@ -360,7 +333,7 @@ def get_diagrams(project_id, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id = project_id):
@@ -370,21 +343,132 @@ def get_diagrams(project_id, token):
     if len(mdjs) < 1:
         abort(410)  # Gone
 
-    parsed = parser.parse_models(mdj_array = mdjs)
-
-    return jsonify({'dia_name_id_pairs': list(set(anal.get_diagram_names_and_ids(parsed)))
+    return jsonify({'dia_name_id_pairs': list(__get_diagram_catalog(mdjs))
                     }), 200  # OK
 
 
+def __get_diagram_catalog(mdjs):
+    """
+    Synopsis:
+        Collects the diagrams contained in the given revisions from their diagram catalogs, without parsing a model.
+    :param mdjs: list of paths to the .mdj files of a project
+    :returns diagrams: set of (name, ID) tuples
+    """
+    diagram_list = list()
+    for mdj in mdjs:
+        diagram_list += parser.get_catalog(mdj) or []
+    return set(diagram_list)
+
+
+def __diagram_exists(mdjs, diagram_id):
+    """
+    Synopsis:
+        Checks whether a diagram is contained in any of the given revisions, according to their diagram catalogs.
+        Requests for unknown diagrams are rejected this way before any timeslice is computed.
+    :param mdjs: list of paths to the .mdj files of a project
+    :param diagram_id: ID of the diagram
+    :returns diagram_found: boolean
+    """
+    return any(catalog_id == diagram_id for name, catalog_id in __get_diagram_catalog(mdjs))
+
+
+def __render_frame(project_id, diagram_id, version, mdjs, frame):
+    """
+    Prerequisite:
+        Only use when holding the render lock of the diagram.
+    Synopsis:
+        Renders a frame of the diagram history into a render workspace and stores it in the cache.
+        Without LAZY_RENDERING all frames are rendered and composed into a new cache version.
+        Nothing is cached if the revisions of the project changed while rendering.
+        This function claims the *db.lock* and *store.lock* system locks and the cache lock of the diagram.
+    Status Codes:
+        404: diagram ID not found in project
+        500: rendering failed
+    :param project_id: unique project ID
+    :param diagram_id: ID of diagram restricting which objects are to be rendered
+    :param version: cache version of the given .mdj files
+    :param mdjs: list of paths to the current .mdj files of the project
+    :param frame: index of frame to be returned
+    :returns file: file, mimetype = image/png
+    """
+    timeslice_array, diagram_found, error_flag = slices.get_timeslices(project_id, diagram_id, mdjs)
+    if error_flag:
+        abort(500)  # Internal Server Error
+    if not diagram_found:
+        abort(404)  # Not found
+
+    workspace = db.create_render_workspace(project_id)
+    try:
+        try:
+            if LAZY_RENDERING:
+                frame_file = anim.render_frame(timeslice_array = timeslice_array, frame = frame, folder = workspace)
+            else:
+                anim.render_timeslices(timeslice_array = timeslice_array, folder = workspace)
+                frame_file = os.path.join(workspace, 'dfv_{:03}.png'.format(frame))
+        except RenderException:
+            traceback.print_exc()
+            abort(500)  # Internal Server Error
+        if not os.path.isfile(frame_file):
+            abort(500)  # Internal Server Error
+
+        with db.lock_diagram_cache(project_id, diagram_id):
+            if db.get_project_models(project_id = project_id) == mdjs:  # else the render is outdated, do not cache it
+                if LAZY_RENDERING:
+                    frame_file = db.add_partial_frame(project_id, diagram_id, version, frame_file)
+                else:
+                    db.build_cache(project_id, diagram_id, version, workspace)
+                    frame_file = db.get_cache_filepath(frame, project_id, diagram_id, version)
+            if not frame_file:
+                abort(500)  # Internal Server Error
+            response = send_file(frame_file, mimetype = 'image/png')
+    finally:
+        if os.path.isdir(workspace):
+            rmtree(workspace, ignore_errors = True)
+
+    return response
+
+
+def __send_cached_frame(project_id, diagram_id, version, mdjs, frame):
+    """
+    Synopsis:
+        Looks up a frame in the cache of a diagram and returns it.
+        With LAZY_RENDERING frames that were rendered on demand are returned as well, in which case the rendering
+        of the complete history is scheduled, as it has not been cached yet.
+        This function claims the cache lock of the diagram.
+    :param project_id: unique project ID
+    :param diagram_id: ID of diagram restricting which objects are rendered
+    :param version: cache version of the given .mdj files
+    :param mdjs: list of paths to the current .mdj files of the project
+    :param frame: index of frame to be returned
+    :returns response: file, mimetype = image/png, or None if the frame is not cached
+    """
+    with db.lock_diagram_cache(project_id, diagram_id):
+        frame_path = db.get_cache_filepath(frame, project_id, diagram_id, version)
+        if frame_path:
+            return send_file(frame_path, mimetype = 'image/png')
+        if LAZY_RENDERING:
+            frame_path = db.get_cache_filepath(frame, project_id, diagram_id, version, partial = True)
+            if frame_path:
+                tasks.schedule_history_render(project_id, diagram_id, version, mdjs)
+                return send_file(frame_path, mimetype = 'image/png')
+    return None
+
+
 @app.route('/snape/1.0/projects/<string:project_id>/history/<string:diagram_id>/<int:frame>/<string:token>',
            methods=['GET'])
 def get_history(project_id, frame, token, diagram_id):
     """
     Synopsis:
         Returns a frame of the visualized diagram history of the given project.
-        The frame is taken from the project cache. If no cache exists for the given diagram,
-        all frames of the history are rendered and composed into a new cache.
-        This function claims the *db.lock* and *cache.lock* system locks.
+        The frame is taken from the project cache. If no cache exists for the given diagram and the current
+        revisions of the project, all frames of the history are rendered from the timeslice store
+        and composed into a new cache version.
+        With LAZY_RENDERING only the requested frame is rendered right away, the remaining frames
+        are rendered and cached by a background task.
+        Concurrent requests for a frame that is not cached wait for a single render of the diagram,
+        frames of other diagrams and cached frames are returned without waiting for it.
+        This function claims the *db.lock* and *store.lock* system locks and the cache and render locks
+        of the diagram.
     Status Codes:
         400: invalid project ID
         403: password invalid
@@ -400,45 +484,39 @@ def get_history(project_id, frame, token, diagram_id):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id = project_id):
         abort(404)  # Not found
 
-    with open('cache.lock', 'a', 0) as cache_lock:
-        plocker.lock(cache_lock, plocker.LOCK_EX)
-        frame_path = db.get_cache_filepath(frame, project_id, diagram_id)
-        if frame_path:
-            return send_file(frame_path, mimetype = 'image/png')
-
-        mdjs = db.get_project_models(project_id = project_id)
-        if len(mdjs) == 0:
-            abort(410)  # Gone
-        if len(mdjs) < frame or frame < 0:
-            abort(416)  # Range not acceptable
-
-        parsed = parser.parse_models(mdj_array = mdjs)
-        if not parsed:
-            abort(500)  # Internal Server Error
-
-        diagram_name_id_pairs = list(set(anal.get_diagram_names_and_ids(parsed)))
-        if diagram_id not in map(lambda x: x[1], diagram_name_id_pairs):
-            abort(404)  # Not found
+    mdjs = db.get_project_models(project_id = project_id)
+    if len(mdjs) == 0:
+        abort(410)  # Gone
+    if not __diagram_exists(mdjs, diagram_id):
+        abort(404)  # Not found
+    version, diagram_found, error_flag = slices.get_cache_version(project_id, diagram_id, mdjs)
+    if error_flag:
+        abort(500)  # Internal Server Error
+    if not diagram_found:
+        abort(404)  # Not found
 
-        timeslice_array, error_flag = anal.get_timeslices(parsed = parsed, diagram_id = diagram_id)
-        if error_flag:
-            abort(500)  # Internal Server Error
+    response = __send_cached_frame(project_id, diagram_id, version, mdjs, frame)
+    if response is not None:
+        return response
 
-        anim.render_timeslices(timeslice_array = timeslice_array)
+    if len(mdjs) < frame or frame < 0:
+        abort(416)  # Range not acceptable
 
-        db.build_cache(project_id, diagram_id)
+    with db.lock_diagram_render(project_id, diagram_id):
+        response = __send_cached_frame(project_id, diagram_id, version, mdjs, frame)  # rendered while waiting
+        if response is not None:
+            return response
+        response = __render_frame(project_id, diagram_id, version, mdjs, frame)
 
-        frame_path = db.get_cache_filepath(frame, project_id, diagram_id)
-        if frame_path:
-            return send_file(frame_path, mimetype = 'image/png')
-        else:
-            abort(500)  # Internal Server Error
+    if LAZY_RENDERING:
+        tasks.schedule_history_render(project_id, diagram_id, version, mdjs)
+    return response
 
 
 @app.route(
@@ -448,7 +526,8 @@ def get_recent_changes(project_id, from_rev, to_rev, token, diagram_id):
     """
     Synopsis:
         Returns a textual diff-log of the given project, restricted to objects in the given diagram.
-        This function claims the *db.lock* system lock.
+        The timeslices of the diagram are taken from the timeslice store.
+        This function claims the *db.lock* and *store.lock* system locks.
     Status Codes:
         400: invalid project ID
         403: password invalid
@@ -464,7 +543,7 @@ def get_recent_changes(project_id, from_rev, to_rev, token, diagram_id):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id = project_id):
@@ -473,19 +552,14 @@ def get_recent_changes(project_id, from_rev, to_rev, token, diagram_id):
     mdjs = db.get_project_models(project_id = project_id)
     if not mdjs:
         abort(410)  # Gone
-
-    parsed = parser.parse_models(mdj_array = mdjs)
-    if not parsed:
-        abort(500)  # Internal Server Error
-
-    diagram_name_id_pairs = list(set(anal.get_diagram_names_and_ids(parsed)))
-    if diagram_id not in map(lambda x: x[1], diagram_name_id_pairs):
+    if not __diagram_exists(mdjs, diagram_id):
         abort(404)  # Not found
 
-    timeslice_array, error_flag = anal.get_timeslices(parsed = parsed, diagram_id = diagram_id)
-
+    timeslice_array, diagram_found, error_flag = slices.get_timeslices(project_id, diagram_id, mdjs)
     if error_flag:
         abort(500)  # Internal Server Error
+    if not diagram_found:
+        abort(404)  # Not found
 
     log = gen.generate_log(timeslice_array = timeslice_array,
                            from_version = from_rev, to_version = to_rev)
@@ -515,7 +589,7 @@ def project_info(project_id, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id = project_id):
@@ -536,6 +610,8 @@ def download_revision(project_id, revision_id, token):
     """
     Synopsis:
         Provides an uploaded revision as download.
+        Compressed revisions are sent as they are stored with Content-Encoding gzip if the client accepts it,
+        otherwise they are decompressed while they are sent.
         This function claims the *db.lock* system lock.
     Status Codes:
         400: invalid project ID
@@ -549,7 +625,7 @@ def download_revision(project_id, revision_id, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
     if not db.check_project_exists(project_id):
@@ -560,12 +636,120 @@ def download_revision(project_id, revision_id, token):
         abort(404)  # Not found
 
     for path in mdjs:
-        if 'v' + str(revision_id) in path:
+        if os.path.basename(os.path.dirname(path)) == 'v' + str(revision_id):
             break
     else:
         abort(404)  # Not found
 
-    return send_file(path, as_attachment = True, attachment_filename = path.split(os.path.sep)[-1])
+    file_name = storage.model_name(path)
+    if storage.is_delta(path):
+        response = Response(storage.read_revision(path), mimetype = 'application/octet-stream')
+        response.headers.add('Content-Disposition', 'attachment', filename = file_name)
+        return response
+    if not storage.is_compressed(path):
+        return send_file(path, as_attachment = True, attachment_filename = file_name)
+    if request.accept_encodings['gzip']:
+        response = send_file(path, as_attachment = True, attachment_filename = file_name)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        def decompress():
+            revision_file = storage.open_revision(path)
+            try:
+                for chunk in iter(lambda: revision_file.read(UPLOAD_CHUNK_SIZE), ''):
+                    yield chunk
+            finally:
+                revision_file.close()
+        response = Response(decompress(), mimetype = 'application/octet-stream')
+        response.headers.add('Content-Disposition', 'attachment', filename = file_name)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/snape/1.0/projects/<string:project_id>/statistics/status/<string:token>')
+def get_statistics_status(project_id, token):
+    """
+    Synopsis:
+        Tells whether the statistics data of a project is up to date with its revisions,
+        and whether a job collecting it is queued or running.
+        This function claims the *db.lock* system lock.
+    Status Codes:
+        200: successful
+        400: invalid project ID
+        403: password invalid
+        404: project not found in database
+    :param project_id: unique project ID
+    :param token: user authentification token
+    :returns response: JSON-object containing
+        1. project ID
+        2. state of the statistics job: 'queued', 'running' or 'idle'
+        3. whether the statistics data of all current revisions has been collected
+    """
+    if not is_int_castable(project_id):
+        abort(400)  # Bad request
+
+    if not tokens.token_is_valid(project_id, token):
+        abort(403)  # Forbidden
+
+    if not db.check_project_exists(project_id = project_id):
+        abort(404)  # Not found
+
+    return jsonify({'project_id': project_id,
+                    'job': tasks.get_statistics_job(project_id) or 'idle',
+                    'up_to_date': collector.statistics_up_to_date(project_id)
+                    }), 200  # OK
+
+
+@app.route('/snape/1.0/projects/<string:project_id>/statistics/data/<string:token>')
+def get_statistics_data(project_id, token):
+    """
+    Synopsis:
+        Provides the data behind the statistics images of a project, optionally restricted to a range of
+        revisions given by the query parameters 'from' and 'to' (revision IDs, both inclusive).
+        The response carries an ETag identifying the revisions the range covers, so unchanged statistics
+        are answered with 304 if the ETag is sent in If-None-Match.
+        This function claims the *db.lock* and *store.lock* system locks.
+    Status Codes:
+        200: successful
+        304: statistics not modified
+        400: invalid project ID or revision range
+        403: password invalid
+        404: project not found in database OR statistics could not be collected
+    :param project_id: unique project ID
+    :param token: user authentification token
+    :returns response: JSON-object containing
+        1. list of revision IDs
+        2. series of the statistics, one value per revision
+        3. the most and the least connected object of the last revision
+    """
+    if not is_int_castable(project_id):
+        abort(400)  # Bad request
+
+    if not tokens.token_is_valid(project_id, token):
+        abort(403)  # Forbidden
+
+    first_revision = request.args.get('from', None)
+    last_revision = request.args.get('to', None)
+    if (first_revision is not None and not is_int_castable(first_revision)) or \
+            (last_revision is not None and not is_int_castable(last_revision)):
+        abort(400)  # Bad request
+    first_revision = int(first_revision) if first_revision is not None else None
+    last_revision = int(last_revision) if last_revision is not None else None
+    if first_revision is not None and last_revision is not None and first_revision > last_revision:
+        abort(400)  # Bad request
+
+    if not db.check_project_exists(project_id = project_id):
+        abort(404)  # Not found
+
+    etag = collector.get_statistics_version(project_id, first_revision, last_revision)
+    if request.if_none_match.contains(etag):
+        response = Response(status = 304)  # Not modified
+    else:
+        stats, error_flag = collector.get_statistics(project_id, first_revision, last_revision)
+        if error_flag:
+            abort(404)  # Not found
+        response = jsonify(stats)
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/snape/1.0/projects/<string:project_id>/statistics/<string:stat_type>/<string:token>')
@@ -573,6 +757,7 @@ def get_statistics(project_id, stat_type, token):
     """
     Synopsis:
         Provides an image containing statistics about a specific project.
+        The images are only drawn when they are requested after the revisions of the project changed.
         This function claims the *db.lock* system lock.
     Status Codes:
         400: invalid project ID
@@ -586,9 +771,13 @@ def get_statistics(project_id, stat_type, token):
     if not is_int_castable(project_id):
         abort(400)  # Bad request
 
-    if not token_is_valid(project_id, token):
+    if not tokens.token_is_valid(project_id, token):
         abort(403)  # Forbidden
 
+    if not db.check_project_exists(project_id = project_id):
+        abort(404)  # Not found
+
+    collector.ensure_statistics_images(project_id)
     stats = db.get_project_statistics(project_id)
 
     reply = list(filter(lambda x: stat_type in x, stats))
@@ -598,6 +787,27 @@ def get_statistics(project_id, stat_type, token):
     return send_file(reply[0], mimetype = 'image/png')
 
 
+@app.route('/snape/1.0/cache/models', methods=['POST'])
+def model_cache_statistics():
+    """
+    Synopsis:
+        Returns the counters of the parsed model cache.
+    Status Codes:
+        200: successful
+        400: password not found in request
+        403: password invalid
+    :returns response: JSON-object containing
+        1. cache hits, disk hits, misses and evictions
+        2. number of cached models, their total size and the configured size limit in bytes
+    """
+    if not request.json or 'password' not in request.json:
+        abort(400)  # Bad request
+    if not server_password_is_valid(request.json['password']):
+        abort(403)  # Forbidden
+
+    return jsonify(parser.get_cache_statistics()), 200  # OK
+
+
 @app.route('/shutdown', methods=['POST'])
 def __shutdown():
     """
@@ -642,13 +852,8 @@ def start_web_service(host = '127.0.0.1', port = 20030, debug = False):
             c['counter'] = 1
             c.close()
 
-        if not os.path.isfile('token_list'):
-            c = shelve.open('token_list')
-            c['token_list'] = []
-            c.close()
 
     assert os.access('id_counter', os.W_OK), 'Could not start SNAPE due to missing permissions'
-    assert os.access('token_list', os.W_OK), 'Could not start SNAPE due to missing permissions'
 
     app.config['PROPAGATE_EXCEPTIONS'] = True
 
@@ -0,0 +1,451 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Revision storage handles the on-disk format of revision files. With COMPRESS_REVISIONS new revisions are stored
+gzip-compressed, which reduces StarUML models to about a tenth of their size. Compressed revisions keep the name
+of the uploaded file plus the extension '.gz', and all readers of revisions open them through this module,
+so all formats can be mixed within a project.
+
+With DELTA_SNAPSHOT_INTERVAL revisions are additionally stored as structural deltas ('.delta') against their
+predecessor. A model is flattened into a dictionary of its elements by '_id', in which nested elements are
+replaced by references, and a delta holds the elements that were added or changed and the IDs of the removed
+ones. Reading a delta reconstructs the revision from its base. Recently reconstructed revisions are cached,
+so reading the revisions of a project in order costs about one snapshot plus the deltas.
+
+Complete revision files are shared between identical revisions of a project: each one is linked into a blob
+folder under the SHA-1 digest of its content, and a revision with the same content becomes another hard link
+to that blob. Deltas record the digest of the revision they encode, so every revision has a content digest.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from cStringIO import StringIO
+from shutil import copyfileobj
+from config import COMPRESS_REVISIONS, DELTA_SNAPSHOT_INTERVAL, UPLOAD_CHUNK_SIZE
+
+GZIP_EXTENSION = '.gz'
+DELTA_EXTENSION = '.delta'
+DELTA_FORMAT = 1
+CHILD_KEY = '$delta_child'  # replaces nested elements in flattened models
+FLAT_CACHE_ENTRIES = 2  # number of reconstructed revisions that are kept in memory
+
+__flat_cache = OrderedDict()  # path -> (modification time and size of the file, flattened model)
+__flat_cache_lock = threading.Lock()
+
+
+def is_compressed(path):
+    """
+    Synopsis:
+        Checks whether a revision file is stored compressed.
+    :param path: path to the revision file
+    :returns compressed: boolean
+    """
+    return path.endswith(GZIP_EXTENSION)
+
+
+def model_name(path):
+    """
+    Synopsis:
+        Returns the name of the uploaded model file of a revision file, i.e. without compression extension.
+    :param path: path to the revision file
+    :returns file_name: string
+    """
+    file_name = os.path.basename(path)
+    if is_compressed(file_name):
+        file_name = file_name[:-len(GZIP_EXTENSION)]
+    if file_name.endswith(DELTA_EXTENSION):
+        file_name = file_name[:-len(DELTA_EXTENSION)]
+    return file_name
+
+
+def is_delta(path):
+    """
+    Synopsis:
+        Checks whether a revision file is stored as delta against its predecessor.
+    :param path: path to the revision file
+    :returns delta: boolean
+    """
+    if is_compressed(path):
+        path = path[:-len(GZIP_EXTENSION)]
+    return path.endswith(DELTA_EXTENSION)
+
+
+def __open_file(path):
+    if is_compressed(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def open_revision(path):
+    """
+    Synopsis:
+        Opens a revision file for reading. Compressed revisions are decompressed while they are read,
+        deltas are reconstructed beforehand.
+    :param path: path to the revision file
+    :returns file: file-like object yielding the content of the .mdj file
+    """
+    if is_delta(path):
+        return StringIO(json.dumps(__unflatten(*__load_flat(path))))
+    return __open_file(path)
+
+
+def read_revision(path):
+    """
+    Synopsis:
+        Returns the content of a revision file.
+    :param path: path to the revision file
+    :returns content: string
+    """
+    revision_file = open_revision(path)
+    try:
+        return revision_file.read()
+    finally:
+        revision_file.close()
+
+
+def write_revision(stream, path):
+    """
+    Synopsis:
+        Writes a revision file from a stream in chunks of UPLOAD_CHUNK_SIZE bytes.
+        With COMPRESS_REVISIONS the file is compressed and '.gz' is appended to the given path.
+    :param stream: file-like object of the .mdj file
+    :param path: path of the revision file without compression extension
+    :returns path: path of the written revision file
+    """
+    if COMPRESS_REVISIONS:
+        path += GZIP_EXTENSION
+        revision_file = gzip.open(path, 'wb')
+    else:
+        revision_file = open(path, 'wb')
+    try:
+        copyfileobj(stream, revision_file, UPLOAD_CHUNK_SIZE)
+    finally:
+        revision_file.close()
+    return path
+
+
+def compress_revision(path):
+    """
+    Synopsis:
+        Replaces an uncompressed revision file by its compressed form. The compressed file is written
+        next to the original and the original is only removed once it is complete.
+    :param path: path to the uncompressed revision file
+    :returns path: path of the compressed revision file
+    """
+    if is_compressed(path):
+        return path
+    temp_path = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(path, 'rb') as revision_file, open(temp_path, 'wb') as temp_file:
+            compressed_file = gzip.GzipFile(filename = os.path.basename(path), mode = 'wb', fileobj = temp_file)
+            try:
+                copyfileobj(revision_file, compressed_file, UPLOAD_CHUNK_SIZE)
+            finally:
+                compressed_file.close()
+        os.rename(temp_path, path + GZIP_EXTENSION)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+    os.remove(path)
+    return path + GZIP_EXTENSION
+
+
+def __read_file(path):
+    model_file = __open_file(path)
+    try:
+        return model_file.read()
+    finally:
+        model_file.close()
+
+
+def __flatten(obj, elements):
+    """
+    Synopsis:
+        Adds an element and all elements nested in it to a flattened model.
+    :param obj: decoded element, i.e. a dictionary with an '_id'
+    :param elements: dictionary of element IDs and elements whose nested elements are replaced by references
+    :returns element_id: ID of the element
+    """
+    def shallow(value):
+        if isinstance(value, dict):
+            if '_id' in value:
+                return {CHILD_KEY: __flatten(value, elements)}
+            return dict((key, shallow(item)) for key, item in value.iteritems())
+        if isinstance(value, list):
+            return [shallow(item) for item in value]
+        return value
+
+    element_id = obj['_id']
+    if element_id in elements:
+        raise ValueError('ambiguous element ID %s' % element_id)
+    elements[element_id] = None  # reserves the ID before nested elements are added
+    elements[element_id] = dict((key, shallow(value)) for key, value in obj.iteritems())
+    return element_id
+
+
+def __unflatten(element_id, elements):
+    """
+    Synopsis:
+        Rebuilds an element and all elements nested in it from a flattened model.
+    :param element_id: ID of the element
+    :param elements: flattened model
+    :returns obj: decoded element
+    """
+    def deep(value):
+        if isinstance(value, dict):
+            if CHILD_KEY in value:
+                return __unflatten(value[CHILD_KEY], elements)
+            return dict((key, deep(item)) for key, item in value.iteritems())
+        if isinstance(value, list):
+            return [deep(item) for item in value]
+        return value
+
+    return dict((key, deep(value)) for key, value in elements[element_id].iteritems())
+
+
+def __base_path(path, base_folder):
+    """
+    Synopsis:
+        Returns the path of the revision file a delta is based on.
+    :param path: path to the delta
+    :param base_folder: name of the revision folder of the base, as stored in the delta
+    :returns base_path: string
+    """
+    folder = os.path.join(os.path.dirname(os.path.dirname(path)), base_folder)
+    return os.path.join(folder, sorted(name for name in os.listdir(folder)
+                                             if not name.startswith('.') and not name.endswith('.tmp'))[0])
+
+
+def __load_flat(path):
+    """
+    Synopsis:
+        Returns a revision as flattened model. Deltas are applied to their base, which is loaded the same way.
+        The result is cached and must not be modified.
+    :param path: path to the revision file
+    :returns root_id: ID of the root element
+    :returns elements: flattened model
+    """
+    stat = os.stat(path)
+    stamp = (stat.st_mtime, stat.st_size)
+    with __flat_cache_lock:
+        entry = __flat_cache.pop(path, None)
+        if entry is not None and entry[0] == stamp:
+            __flat_cache[path] = entry
+            return entry[1]
+
+    content = __read_file(path)
+    if is_delta(path):
+        delta = json.loads(content)
+        root_id, elements = __load_flat(__base_path(path, delta['base']))
+        elements = dict(elements)
+        elements.update(delta['changed'])
+        for element_id in delta['removed']:
+            del elements[element_id]
+        flat = (delta['root'], elements)
+    else:
+        elements = dict()
+        flat = (__flatten(json.loads(content), elements), elements)
+
+    with __flat_cache_lock:
+        __flat_cache[path] = (stamp, flat)
+        while len(__flat_cache) > FLAT_CACHE_ENTRIES:
+            __flat_cache.popitem(last = False)
+    return flat
+
+
+def __chain_length(path):
+    """
+    Synopsis:
+        Returns the number of deltas that have to be applied to read a revision.
+    :param path: path to the revision file
+    :returns length: integer
+    """
+    length = 0
+    while is_delta(path):
+        path = __base_path(path, json.loads(__read_file(path))['base'])
+        length += 1
+    return length
+
+
+def __write(path, content):
+    """
+    Synopsis:
+        Writes a revision file, compressed if its path ends with '.gz'. The file is written next to its
+        destination first, so it never appears incomplete.
+    :param path: path of the revision file
+    :param content: string
+    """
+    temp_path = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as temp_file:
+            if is_compressed(path):
+                revision_file = gzip.GzipFile(filename = os.path.basename(path)[:-len(GZIP_EXTENSION)],
+                                              mode = 'wb', fileobj = temp_file)
+                try:
+                    revision_file.write(content)
+                finally:
+                    revision_file.close()
+            else:
+                temp_file.write(content)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def encode_delta(path, base_path):
+    """
+    Synopsis:
+        Replaces a complete revision file by a delta against the given base revision, if DELTA_SNAPSHOT_INTERVAL
+        is set. The revision is kept as snapshot if the chain of deltas leading to it would reach the interval,
+        if it cannot be flattened (e.g. because of ambiguous element IDs) or if the delta would not reproduce it.
+    :param path: path to the complete revision file
+    :param base_path: path to the revision file of the predecessor
+    :returns path: path of the revision file, which ends with '.delta' (and '.gz') if a delta was stored
+    """
+    if DELTA_SNAPSHOT_INTERVAL <= 0 or __chain_length(base_path) + 1 >= DELTA_SNAPSHOT_INTERVAL:
+        return path
+    try:
+        base_root_id, base_elements = __load_flat(base_path)
+        content = __read_file(path)
+        model = json.loads(content)
+        elements = dict()
+        root_id = __flatten(model, elements)
+    except (KeyError, TypeError, ValueError):
+        return path
+
+    delta = OrderedDict([('format', DELTA_FORMAT),
+                         ('base', os.path.basename(os.path.dirname(base_path))),
+                         ('root', root_id),
+                         ('sha1', hashlib.sha1(content).hexdigest()),
+                         ('changed', dict((element_id, element) for element_id, element in elements.iteritems()
+                                          if base_elements.get(element_id) != element)),
+                         ('removed', [element_id for element_id in base_elements if element_id not in elements])])
+    reconstructed = dict(base_elements)
+    reconstructed.update(delta['changed'])
+    for element_id in delta['removed']:
+        del reconstructed[element_id]
+    if __unflatten(root_id, reconstructed) != model:
+        return path
+
+    delta_path = os.path.join(os.path.dirname(path), model_name(path) + DELTA_EXTENSION)
+    if is_compressed(path):
+        delta_path += GZIP_EXTENSION
+    __write(delta_path, json.dumps(delta))
+    os.remove(path)
+    return delta_path
+
+
+def materialize(path):
+    """
+    Synopsis:
+        Replaces a delta by the complete revision, e.g. before the revision it is based on is removed.
+    :param path: path to the revision file
+    :returns path: path of the complete revision file
+    """
+    if not is_delta(path):
+        return path
+    full_path = os.path.join(os.path.dirname(path), model_name(path))
+    if is_compressed(path):
+        full_path += GZIP_EXTENSION
+    __write(full_path, json.dumps(__unflatten(*__load_flat(path))))
+    os.remove(path)
+    return full_path
+
+
+def get_base_folder(path):
+    """
+    Synopsis:
+        Returns the name of the revision folder a delta is based on.
+    :param path: path to the revision file
+    :returns base_folder: string, or None if the revision is stored completely
+    """
+    if not is_delta(path):
+        return None
+    return json.loads(__read_file(path))['base']
+
+
+def content_digest(path):
+    """
+    Synopsis:
+        Returns the SHA-1 digest of the model stored in a revision file, independent of compression.
+        For a delta this is the digest of the revision it encodes.
+    :param path: path to the revision file
+    :returns digest: hexadecimal string
+    """
+    if is_delta(path):
+        digest = json.loads(__read_file(path)).get('sha1')
+        if digest:
+            return digest
+    digest = hashlib.sha1()
+    model_file = open_revision(path)
+    try:
+        for chunk in iter(lambda: model_file.read(UPLOAD_CHUNK_SIZE), ''):
+            digest.update(chunk)
+    finally:
+        model_file.close()
+    return digest.hexdigest()
+
+
+def share_revision(path, blob_folder, digest):
+    """
+    Synopsis:
+        Stores a complete revision file content-addressed in the given blob folder. If the folder already holds
+        a blob with the same content, the revision file is replaced by a hard link to it, otherwise the revision
+        file becomes the blob. Deltas and file systems without hard links are left as they are.
+    :param path: path to the revision file
+    :param blob_folder: folder of the blobs
+    :param digest: content digest of the revision, see content_digest
+    """
+    if is_delta(path):
+        return
+    blob_path = os.path.join(blob_folder, digest + (GZIP_EXTENSION if is_compressed(path) else ''))
+    try:
+        if not os.path.isdir(blob_folder):
+            os.makedirs(blob_folder)
+        if not os.path.isfile(blob_path):
+            os.link(path, blob_path)
+        elif not os.path.samefile(path, blob_path):
+            temp_path = '%s.%i.tmp' % (path, os.getpid())
+            os.link(blob_path, temp_path)
+            os.rename(temp_path, path)
+    except OSError:
+        traceback.print_exc()
+
+
+def remove_unshared_blobs(blob_folder):
+    """
+    Synopsis:
+        Removes the blobs that are no longer linked to any revision file.
+    :param blob_folder: folder of the blobs
+    """
+    if not os.path.isdir(blob_folder):
+        return
+    for name in os.listdir(blob_folder):
+        blob_path = os.path.join(blob_folder, name)
+        if os.stat(blob_path).st_nlink <= 1:
+            os.remove(blob_path)
@@ -20,11 +20,15 @@ along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from config import *
-import shelve
 import hashlib
+import hmac
 import os
 import string
 import random
+import threading
+
+__secret_hashes = dict()  # hash file name -> (modification time, hash)
+__secret_hashes_lock = threading.Lock()
 
 
 def is_int_castable(s):
@@ -56,18 +60,37 @@ def allowed_file(filename):
     return suffix[0] + suffix[1] + suffix[2] in ALLOWED_EXTENSIONS
 
 
+def __secret_hash(file_name):
+    """
+    Synopsis:
+        Returns the hash stored in the given file of the resources folder.
+        Hashes are read once and only read again when the modification time of their file changes.
+    :param file_name: name of the hash file
+    :returns correct_hash: string
+    """
+    path = os.path.join('resources', file_name)
+    mtime = os.stat(path).st_mtime
+    with __secret_hashes_lock:
+        if file_name in __secret_hashes and __secret_hashes[file_name][0] == mtime:
+            return __secret_hashes[file_name][1]
+    with open(path, 'r') as hash_file:
+        correct_hash = hash_file.read().strip()
+    with __secret_hashes_lock:
+        __secret_hashes[file_name] = (mtime, correct_hash)
+    return correct_hash
+
+
 def server_password_is_valid(password):
     """
     Synopsis:
         Calculates SHA-512 hash of server secret and compares to stored hash.
         Hash is used in order to avoid storage of correct server secret.
+        The hashes are compared in constant time, so the comparison does not reveal how much of them matches.
     :param password: password to be checked for validity
     :returns valid: boolean
     """
     password_hash = hashlib.sha512(password).hexdigest()
-    with open(os.path.join('resources', 'server-secret-hash.txt'), 'r') as hash_file:
-        correct_hash = hash_file.read()
-    return password_hash == correct_hash
+    return hmac.compare_digest(password_hash, __secret_hash('server-secret-hash.txt'))
 
 
 def shutdown_password_is_valid(password):
@@ -75,45 +98,22 @@ def shutdown_password_is_valid(password):
     Synopsis:
         Calculates SHA-512 hash of the shutdown routine secret and compares to stored hash.
         Hash is used in order to avoid storage of correct shutdown routine secret.
+        The hashes are compared in constant time, so the comparison does not reveal how much of them matches.
     :param password: password to be checked for validity
     :returns valid: boolean
     """
     password_hash = hashlib.sha512(password).hexdigest()
-    with open(os.path.join('resources', 'shutdown-server-secret-hash.txt'), 'r') as hash_file:
-        correct_hash = hash_file.read()
-    return password_hash == correct_hash
-
-
-def token_is_valid(project_id, token):
-    """
-    Synopsis:
-        Checks if a user submitted token is valid for a given project.
-    :param project_id: ID of the project for which validation is checked
-    :param token: token for which the access rights are checked
-    :returns valid: boolean
-    """
-    valid = False
-    try:
-        token_file = shelve.open('token_list')
-        if token in token_file[str(project_id)]:
-            valid = True
-        token_file.close()
-    finally:
-        return valid
+    return hmac.compare_digest(password_hash, __secret_hash('shutdown-secret-hash.txt'))
 
 
-def generate_token(existing_tokens):
+def generate_token():
     """
     Synopsis:
-        Generate unique user security tokens for project login.
+        Generate a user security token for project login.
         Tokens are composed of ASCII letters and digits, but not special characters.
-    :param existing_tokens: list of tokens already in use
+        Uniqueness is ensured by the token store, which rejects tokens that are already in use.
     :returns token: string
     """
     chars = string.ascii_letters + string.digits
     rnd = random.SystemRandom()
-    res = ''.join(rnd.choice(chars) for _ in range(TOKEN_LENGTH))
-    while res in existing_tokens:
-        rnd = random.SystemRandom()
-        res = ''.join(rnd.choice(chars) for _ in range(TOKEN_LENGTH))
-    return res
+    return ''.join(rnd.choice(chars) for _ in range(TOKEN_LENGTH))
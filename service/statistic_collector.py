@@ -22,9 +22,14 @@ along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
 import project_database as db
 import model_parser as parser
 import diff_analyzer as anal
+import timeslice_store as slices
 import graph_animator as anim
 import os
-import subprocess
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from shutil import rmtree
 import numpy as np
 import matplotlib
 matplotlib.use('Agg')
@@ -34,15 +39,57 @@ from matplotlib.spines import Spine
 from matplotlib.projections.polar import PolarAxes
 from matplotlib.projections import register_projection
 
+DATA_POINT_VERSION = '2'  # changes whenever the data points are computed differently, so stored ones are replaced
 
-def _collect_stats(project_id):
+_plot_lock = threading.Lock()  # pyplot keeps the current figure globally, so figures are drawn one at a time
+_image_lock = threading.Lock()  # held while images are generated on request, so they are generated once
+
+
+def _collect_points(project_id, revisions):
+    """
+    Synopsis:
+        Returns the data points of the given revisions of a project.
+        The data of a revision only depends on the revision and its predecessors, so it is computed once and
+        stored as data point, keyed by the content digests of these revisions. Only the data points of new
+        revisions, or of revisions following a deleted one, are computed. Their timeslices are taken from the
+        timeslice store, which only computes the timeslices of revisions it has not seen yet.
+    :param project_id: ID of the project
+    :param revisions: list of (revision ID, path to .mdj file, content digest) tuples of all revisions of the
+        project, as returned by get_revision_digests
+    :returns points: list of dictionaries, one per revision
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    stored_points = db.get_statistics_data(project_id = project_id)
+    points = OrderedDict()
+    timeslice_array = None
+    for n, (key, (revision_id, mdj, digest)) in enumerate(zip(_data_point_keys(revisions), revisions)):
+        if key in stored_points:
+            points[key] = stored_points[key]
+            continue
+        if timeslice_array is None:
+            timeslice_array, diagram_found, error_flag = slices.get_timeslices(
+                project_id, 'all', [revision[1] for revision in revisions])
+            if error_flag or len(timeslice_array) != len(revisions):
+                return [], True
+        points[key] = _collect_revision_stats(mdj, timeslice_array[n])
+    if timeslice_array is not None or len(points) != len(stored_points):
+        db.set_statistics_data(project_id = project_id, data = points)
+    return points.values(), False
+
+
+def _collect_stats(project_id, first_revision = None, last_revision = None):
     """
     Synopsis:
         Collects all the data neccessary to render stats pngs for a given project.
+        The connectivity data belongs to the last revision of the range.
     :param project_id: ID of the project for which the stats are to be collected
+    :param first_revision: ID of the first revision to be included, or None to start at the first revision
+    :param last_revision: ID of the last revision to be included, or None to end at the latest revision
     :returns stats: dictionary of stats
+    :returns error_flag: indicator that an error occurred during execution
     """
     stats = {
+        'revision_ids': list(),
         'nodes_over_time': list(),
         'edges_over_time': list(),
         'most_connected_obj': None,
@@ -52,124 +99,218 @@ def _collect_stats(project_id):
         'class_function_complexity': list()
     }
 
-    mdjs = db.get_project_models(project_id = project_id)
-    if not mdjs:
-        return stats
+    revisions = db.get_revision_digests(project_id = project_id)
+    if not revisions:
+        return stats, False
 
-    parsed, timeslice_array = _collect_quantity_stats(mdjs, stats)
-    _collect_connectivity_stats(parsed, stats)
-    _collect_complexity_stats(stats, timeslice_array)
+    points, error_flag = _collect_points(project_id, revisions)
+    if error_flag:
+        return stats, True
 
-    os.remove('degree_script.gvpr')
-    os.remove('temp.dot')
+    for (revision_id, mdj, digest), point in zip(revisions, points):
+        if not _in_range(revision_id, first_revision, last_revision):
+            continue
+        stats['revision_ids'].append(revision_id)
+        stats['nodes_over_time'].append(point['nodes'])
+        stats['edges_over_time'].append(point['edges'])
+        stats['model_complexity_over_time'].append(point['model_complexity'])
+        stats['class_data_complexity'].append(point['class_data_complexity'])
+        stats['class_function_complexity'].append(point['class_function_complexity'])
+        stats['most_connected_obj'] = point['most_connected_obj']
+        stats['least_connected_obj'] = point['least_connected_obj']
 
-    return stats
+    return stats, False
 
 
-def _collect_complexity_stats(stats, timeslice_array):
+def _in_range(revision_id, first_revision, last_revision):
     """
     Synopsis:
-        Collects data about model complexity.
-    :param stats: dictionary of stats where the results will be added
-    :param timeslice_array: list of timeslices
+        Checks whether a revision belongs to a range of revisions.
+    :param revision_id: ID of the revision
+    :param first_revision: ID of the first revision of the range, or None to start at the first revision
+    :param last_revision: ID of the last revision of the range, or None to end at the latest revision
+    :returns in_range: boolean
     """
-    for n, timeslice in enumerate(timeslice_array):
-        min_amount_of_methods = 1e31 - 1
-        total_amount_of_methods = 0
-        min_amount_of_attributes = 1e31 - 1
-        total_amount_of_attributes = 0
-        attribute_nodes = 0
-        method_nodes = 0
+    return (first_revision is None or revision_id >= first_revision) and \
+        (last_revision is None or revision_id <= last_revision)
 
-        for obj in timeslice:
-            try:
-                if len(obj.attributes) > 0:
-                    min_amount_of_attributes = min(len(obj.attributes), min_amount_of_attributes)
-                    total_amount_of_attributes += len(obj.attributes)
-                    attribute_nodes += 1
-                if len(obj.methods) > 0:
-                    min_amount_of_methods = min(len(obj.methods), min_amount_of_methods)
-                    total_amount_of_methods += len(obj.methods)
-                    method_nodes += 1
-            except AttributeError:
-                continue
 
-        stats['class_data_complexity'].append((1 - (float(attribute_nodes * min_amount_of_attributes) /
-                                                    max(total_amount_of_attributes, 1))) ** 2 % 1)
-        stats['class_function_complexity'].append((1 - (float(method_nodes * min_amount_of_methods) /
-                                                        max(total_amount_of_methods, 1))) ** 2 % 1)
+def _data_point_keys(revisions):
+    """
+    Synopsis:
+        Returns the keys of the data points of the given revisions. The key of a revision is chained over the
+        content digests of the revision and all its predecessors.
+    :param revisions: list of (revision ID, path to .mdj file, content digest) tuples, as returned by
+        get_revision_digests
+    :returns keys: list of strings
+    """
+    keys = list()
+    key = DATA_POINT_VERSION
+    for revision_id, mdj, digest in revisions:
+        key = hashlib.sha1(key + digest).hexdigest()
+        keys.append(key)
+    return keys
+
+
+def get_statistics_version(project_id, first_revision = None, last_revision = None):
+    """
+    Synopsis:
+        Identifies the statistics of the current revisions of a project, or of a range of them, without
+        collecting them. Every change of the revisions in the range or before it results in a new version.
+        The version only depends on the revisions the range covers, so all ranges covering the same revisions,
+        e.g. no range and a range around all revisions, have the same version.
+    :param project_id: ID of the project
+    :param first_revision: ID of the first revision to be included, or None to start at the first revision
+    :param last_revision: ID of the last revision to be included, or None to end at the latest revision
+    :returns version: string
+    """
+    revisions = db.get_revision_digests(project_id = project_id)
+    covered = [(revision_id, key) for (revision_id, mdj, digest), key in zip(revisions, _data_point_keys(revisions))
+               if _in_range(revision_id, first_revision, last_revision)]
+    if not covered:
+        return DATA_POINT_VERSION
+    return hashlib.sha1(covered[-1][1] + ''.join(',%i' % revision_id for revision_id, key in covered)).hexdigest()
+
+
+def statistics_up_to_date(project_id):
+    """
+    Synopsis:
+        Checks whether the data points of all current revisions of a project have been collected.
+    :param project_id: ID of the project
+    :returns up_to_date: boolean
+    """
+    keys = _data_point_keys(db.get_revision_digests(project_id = project_id))
+    return not keys or keys[-1] in db.get_statistics_data(project_id = project_id)
+
+
+def update_statistics(project_id):
+    """
+    Synopsis:
+        Collects the data points of all revisions of a project that have not been collected yet.
+        The images are only drawn once they are requested, see ensure_statistics_images.
+    :param project_id: ID of the project
+    """
+    revisions = db.get_revision_digests(project_id = project_id)
+    if revisions:
+        _collect_points(project_id, revisions)
+
+
+def get_statistics(project_id, first_revision = None, last_revision = None):
+    """
+    Synopsis:
+        Returns the data behind the statistics images of a project, for all revisions or a range of them.
+        Missing data points are collected first.
+    :param project_id: ID of the project
+    :param first_revision: ID of the first revision to be included, or None to start at the first revision
+    :param last_revision: ID of the last revision to be included, or None to end at the latest revision
+    :returns stats: dictionary of the revision IDs, the series of the statistics, one value per revision,
+        and the most and least connected objects of the last revision
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    return _collect_stats(project_id, first_revision, last_revision)
+
+
+def _collect_revision_stats(mdj, timeslice):
+    """
+    Synopsis:
+        Collects the data point of a single revision.
+        Nodes and edges are taken from the frame of the revision's timeslice, as shown in the history.
+    :param mdj: path to the .mdj file of the revision
+    :param timeslice: timeslice of all diagrams of the revision
+    :returns point: dictionary of stats
+    """
+    point = dict()
+    nodes, edges = anim.get_frame_graph(timeslice)
+    _collect_quantity_stats(nodes, edges, point)
+    _collect_connectivity_stats(parser.parse_models(mdj_array = [mdj]), nodes, edges, point)
+    _collect_complexity_stats(point, timeslice)
+    return point
 
 
-def _collect_connectivity_stats(parsed, stats):
+def _collect_complexity_stats(stats, timeslice):
     """
     Synopsis:
-        Collects data about model connectivity.
+        Collects data about model complexity.
     :param stats: dictionary of stats where the results will be added
-    :param parsed: list of object trees
+    :param timeslice: timeslice of the revision
     """
-    with open('degree_script.gvpr', 'w') as script:
-        script.write('''
-        N {
-            printf("%s,%d,%d\n", $.name, $.indegree, $.outdegree);
-        }
-        ''')
-    cmd = ['gvpr', '-f', 'degree_script.gvpr', 'temp.dot']
-    p = subprocess.Popen(cmd, stdout = subprocess.PIPE)
-    gvpr_result = list(map(lambda x: tuple([x.split(',')[0],
-                                            int(x.split(',')[1]) + int(x.split(',')[2].replace('\r', ''))]),
-                           p.stdout.read().split('\n')[:-1]))
-    sorted_gvpr_result = sorted(gvpr_result, key = lambda x: x[1])
-    most_connected_id = sorted_gvpr_result[-1]
-    least_connected_id = sorted_gvpr_result[0]
-    name_view = anal.find_tree_elem_by_id(parsed[-1],
-                                          most_connected_id[0]).get_subview(view_type = 'UMLNameCompartmentView')
-    name_subview = name_view.get_subview(view_type = 'LabelView',
-                                         view_id = name_view.name_label)
-    stats['most_connected_obj'] = name_subview.text
-    name_view = anal.find_tree_elem_by_id(parsed[-1],
-                                          least_connected_id[0]).get_subview(view_type = 'UMLNameCompartmentView')
-    name_subview = name_view.get_subview(view_type = 'LabelView',
-                                         view_id = name_view.name_label)
-    stats['least_connected_obj'] = name_subview.text
-
-
-def _collect_quantity_stats(mdjs, stats):
+    min_amount_of_methods = 1e31 - 1
+    total_amount_of_methods = 0
+    min_amount_of_attributes = 1e31 - 1
+    total_amount_of_attributes = 0
+    attribute_nodes = 0
+    method_nodes = 0
+
+    for obj in timeslice:
+        try:
+            if len(obj.attributes) > 0:
+                min_amount_of_attributes = min(len(obj.attributes), min_amount_of_attributes)
+                total_amount_of_attributes += len(obj.attributes)
+                attribute_nodes += 1
+            if len(obj.methods) > 0:
+                min_amount_of_methods = min(len(obj.methods), min_amount_of_methods)
+                total_amount_of_methods += len(obj.methods)
+                method_nodes += 1
+        except AttributeError:
+            continue
+
+    stats['class_data_complexity'] = (1 - (float(attribute_nodes * min_amount_of_attributes) /
+                                           max(total_amount_of_attributes, 1))) ** 2 % 1
+    stats['class_function_complexity'] = (1 - (float(method_nodes * min_amount_of_methods) /
+                                               max(total_amount_of_methods, 1))) ** 2 % 1
+
+
+def _collect_connectivity_stats(parsed, nodes, edges, stats):
     """
     Synopsis:
-        Collects data about model component quantity.
-    :param mdjs: list of mdj file paths
+        Collects data about model connectivity, i.e. the names of the objects with the most and the fewest
+        relations. Nodes without a name, e.g. notes, are skipped.
+    :param parsed: list of object trees
+    :param nodes: list of node IDs of the revision's frame
+    :param edges: list of (source ID, target ID) tuples of the revision's frame
     :param stats: dictionary of stats where the results will be added
-    :returns parsed: list of object trees
-    :returns timeslice_array: list of timeslices
     """
-    parsed = list()
-    timeslice_array = list()
-    for n in range(1, len(mdjs) + 1):
-        if n != 1:  # keep the last .dot file
-            os.remove('temp.dot')
+    node_indices = dict((node_id, n) for n, node_id in enumerate(nodes))
+    edge_array = np.array([(node_indices[source], node_indices[target]) for source, target in edges],
+                          dtype = np.intp).reshape(-1, 2)
+    degrees = (np.bincount(edge_array[:, 0], minlength = len(nodes)) +
+               np.bincount(edge_array[:, 1], minlength = len(nodes)))
+    ordered = np.argsort(degrees, kind = 'mergesort')  # stable, ties keep the order of the node IDs
 
-        parsed = parser.parse_models(mdj_array = mdjs[:n])
-        timeslice_array, error_flag = anal.get_timeslices(parsed = parsed, diagram_id = 'all')
-        graphs = anim.render_timeslices(timeslice_array = timeslice_array, disable_rendering = True)
+    names = (_object_name(parsed[-1], nodes[n]) for n in ordered[::-1])
+    stats['most_connected_obj'] = next((name for name in names if name is not None), None)
+    names = (_object_name(parsed[-1], nodes[n]) for n in ordered)
+    stats['least_connected_obj'] = next((name for name in names if name is not None), None)
 
-        with open('temp.dot', 'w') as temp_dot_file:
-            for line in graphs[-1].split('\n'):
-                if 'style=invis' not in line:
-                    temp_dot_file.write(line + '\n')
 
-        cmd = ['gc', '-n', 'temp.dot']
-        p = subprocess.Popen(cmd, stdout = subprocess.PIPE)
-        nodes = int('0' + p.stdout.read().replace(' ', '').split('G')[0])
-        stats['nodes_over_time'].append(nodes)
+def _object_name(tree, obj_id):
+    """
+    Synopsis:
+        Returns the text of the name label of a node.
+    :param tree: object tree of the revision
+    :param obj_id: ID of the node
+    :returns name: string, or None if the node has no name label
+    """
+    obj = anal.find_tree_elem_by_id(tree, obj_id)
+    name_view = obj.get_subview(view_type = 'UMLNameCompartmentView') if obj is not None else None
+    if name_view is None:
+        return None
+    name_subview = name_view.get_subview(view_type = 'LabelView', view_id = name_view.name_label)
+    return name_subview.text if name_subview is not None else None
 
-        cmd = ['gc', '-e', 'temp.dot']
-        p = subprocess.Popen(cmd, stdout = subprocess.PIPE)
-        edges = int('0' + p.stdout.read().replace(' ', '').split('G')[0])
-        stats['edges_over_time'].append(edges)
 
-        stats['model_complexity_over_time'].append(
-            min((float(edges) / nodes) / (nodes * (nodes - 1) / 2) if nodes > 1 else 0, 1))
-    return parsed, timeslice_array
+def _collect_quantity_stats(nodes, edges, stats):
+    """
+    Synopsis:
+        Collects data about model component quantity.
+    :param nodes: list of node IDs of the revision's frame
+    :param edges: list of (source ID, target ID) tuples of the revision's frame
+    :param stats: dictionary of stats where the results will be added
+    """
+    stats['nodes'] = len(nodes)
+    stats['edges'] = len(edges)
+    stats['model_complexity'] = min((float(len(edges)) / len(nodes)) / (len(nodes) * (len(nodes) - 1) / 2)
+                                    if len(nodes) > 1 else 0, 1)
 
 
 def _radar_factory(dimensions):
@@ -228,28 +369,56 @@ def _unit_poly_verts(theta):
     return verts
 
 
+def ensure_statistics_images(project_id):
+    """
+    Synopsis:
+        Generates the statistics images of a project, unless they belong to the current revisions already.
+    :param project_id: ID of the project
+    """
+    version = get_statistics_version(project_id)
+    if db.get_statistics_version(project_id) == version:
+        return
+    with _image_lock:
+        if db.get_statistics_version(project_id) != version:
+            generate_statistics(project_id)
+
+
 def generate_statistics(project_id):
     """
     Synopsis:
         Generates statistics folder for a project.
+        The images are drawn in a temporary folder of their own, so the statistics of several projects
+        can be generated concurrently. If the data could not be collected, no images are stored.
     :param project_id: ID of the project for which statistics should be generated
     """
-    stats = _collect_stats(project_id)
-    with plt.rc_context({'axes.edgecolor': '#7d3c8c',
-                         'xtick.color': 'white',
-                         'ytick.color': 'white'}):
-        fig = plt.figure(figsize=(10, 10), facecolor='#411f48')
-        _generate_complexity_stats(fig, stats)
-        _generate_quantity_stats(fig, stats)
-        db.add_statistics(project_id, ['complexity.png', 'quantity.png'])
+    version = get_statistics_version(project_id)
+    stats, error_flag = _collect_stats(project_id)
+    if error_flag:
+        return
+    folder = tempfile.mkdtemp(prefix = '.statistics_', dir = '.')
+    try:
+        with _plot_lock, plt.rc_context({'axes.edgecolor': '#7d3c8c',
+                                         'xtick.color': 'white',
+                                         'ytick.color': 'white'}):
+            fig = plt.figure(figsize=(10, 10), facecolor='#411f48')
+            try:
+                _generate_complexity_stats(fig, stats, folder)
+                _generate_quantity_stats(fig, stats, folder)
+            finally:
+                plt.close(fig)
+        db.add_statistics(project_id, [os.path.join(folder, 'complexity.png'), os.path.join(folder, 'quantity.png')],
+                          version = version)
+    finally:
+        rmtree(folder, ignore_errors = True)
 
 
-def _generate_quantity_stats(fig, stats):
+def _generate_quantity_stats(fig, stats, folder):
     """
     Synopsis:
-        Generates a quantity statistic png in the root folder from the given stats.
+        Generates a quantity statistic png in the given folder from the given stats.
     :param fig: current matplotlib figure
     :param stats: stats file containing data from which to generate statistics
+    :param folder: folder the png is written to
     """
     ax = fig.add_subplot(211)
     plt.xlim(0, len(stats['nodes_over_time']))
@@ -272,15 +441,16 @@ def _generate_quantity_stats(fig, stats):
         plt.text(0.5, 0.5, 'Not enough data', horizontalalignment = 'center',
                  verticalalignment = 'center', transform = ax.transAxes, bbox = dict(facecolor = 'red', alpha = 0.5))
     plt.tight_layout()
-    plt.savefig('quantity.png', dpi = 90, facecolor = '#411f48')
+    plt.savefig(os.path.join(folder, 'quantity.png'), dpi = 90, facecolor = '#411f48')
 
 
-def _generate_complexity_stats(fig, stats):
+def _generate_complexity_stats(fig, stats, folder):
     """
     Synopsis:
-        Generates a complexity statistic png in the root folder from the given stats.
+        Generates a complexity statistic png in the given folder from the given stats.
     :param fig: current matplotlib figure
     :param stats: stats file containing data from which to generate statistics
+    :param folder: folder the png is written to
     """
     if stats['nodes_over_time']:
         theta = _radar_factory(dimensions = 3)
@@ -297,5 +467,5 @@ def _generate_complexity_stats(fig, stats):
     else:
         plt.text(0.5, 0.5, 'Not enough data', horizontalalignment = 'center',
                  verticalalignment = 'center', bbox = dict(facecolor = 'red', alpha = 0.5))
-    plt.savefig('complexity.png', dpi = 90, facecolor = '#411f48')
+    plt.savefig(os.path.join(folder, 'complexity.png'), dpi = 90, facecolor = '#411f48')
     plt.clf()
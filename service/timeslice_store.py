@@ -0,0 +1,331 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+The timeslice store keeps the timeslices of every requested (project, diagram) pair on disk, so that
+the history of a diagram does not need to be recomputed from all revisions of a project on every request.
+Each timeslice is stored together with the revision file it was computed from. A stored timeslice remains
+valid as long as its revision file and the revision preceding it are unchanged, so adding a revision only
+computes the new timeslice and deleting a revision only recomputes the timeslice following it.
+The digests of the stored timeslices identify the frames rendered from them, so they also determine the cache
+version of a diagram and whether the diagram changed with a revision.
+"""
+
+import os
+import hashlib
+import threading
+import traceback
+import cPickle as pickle
+import portalocker as plocker
+import project_database as db
+import model_parser as parser
+import diff_analyzer as anal
+
+STORE_FORMAT = 4        # increase whenever the layout of stored timeslices or Drawables changes
+STORE_EXTENSION = '.timeslices'
+
+__versions = dict()  # (project ID, diagram ID) -> (revision keys, cache version, diagram_found) of the last refresh
+__versions_lock = threading.Lock()
+
+
+def __revision_key(mdj):
+    """
+    Synopsis:
+        Identifies a revision file by its path, modification time and size.
+    :param mdj: path to a .mdj file
+    :returns key: tuple
+    """
+    stat = os.stat(mdj)
+    return mdj, stat.st_mtime, stat.st_size
+
+
+def __timeslice_digest(timeslice):
+    """
+    Synopsis:
+        Identifies the content of a timeslice, i.e. the state and the changes of its Drawables.
+    :param timeslice: list of Drawables
+    :returns digest: string
+    """
+    digest = hashlib.sha1()
+    for drawable in timeslice:
+        digest.update(repr((type(drawable).__name__, drawable.obj_id, drawable.fingerprint(), drawable.changes)))
+    return digest.hexdigest()
+
+
+def __new_store(keys = (), timeslices = (), diagram_found = ()):
+    """
+    Synopsis:
+        Creates a store of the given timeslices.
+    :param keys: revision keys of the timeslices
+    :param timeslices: list of timeslices
+    :param diagram_found: list of diagram_found flags of the timeslices
+    :returns store: dictionary of revision keys, timeslices, their digests and diagram_found flags
+    """
+    return {'format': STORE_FORMAT, 'revisions': list(keys), 'timeslices': list(timeslices),
+            'digests': [__timeslice_digest(timeslice) for timeslice in timeslices],
+            'diagram_found': list(diagram_found)}
+
+
+def __store_version(store):
+    """
+    Synopsis:
+        Identifies the frames rendered from a store. Revisions that result in the same timeslices,
+        e.g. after their files were compressed, keep the version.
+    :param store: store of a diagram
+    :returns version: string
+    """
+    return hashlib.sha1('\n'.join(store['digests'])).hexdigest()
+
+
+def __load_store(path):
+    """
+    Synopsis:
+        Loads a persisted store. Missing, outdated or broken stores are treated as empty.
+    :param path: path of the store file
+    :returns store: dictionary of revision keys, timeslices, their digests and diagram_found flags
+    """
+    if os.path.isfile(path):
+        try:
+            with open(path, 'rb') as store_file:
+                store = pickle.load(store_file)
+            if store.get('format') == STORE_FORMAT:
+                return store
+        except Exception:
+            traceback.print_exc()
+    return __new_store()
+
+
+def __save_store(path, store):
+    """
+    Synopsis:
+        Persists a store. The file is replaced atomically, so readers never see a partial store.
+    :param path: path of the store file
+    :param store: store to be saved
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as store_file:
+        pickle.dump(store, store_file, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+
+def __refresh_store(store, diagram_id, mdjs):
+    """
+    Synopsis:
+        Brings a store up to date with the given revision files. Stored timeslices are reused if their revision
+        and its predecessor are unchanged, all other timeslices are computed from their parsed revision.
+    :param store: store to be refreshed
+    :param diagram_id: ID of the diagram the store belongs to
+    :param mdjs: list of paths to the current .mdj files of the project
+    :returns store: refreshed store or None, if a revision could not be processed
+    :returns changed: True, if the timeslices differ from the stored ones, i.e. frames of the diagram changed
+    """
+    keys = [__revision_key(mdj) for mdj in mdjs]
+    stored_positions = dict((key, n) for n, key in enumerate(store['revisions']))
+    refreshed = __new_store(keys)
+
+    for n, key in enumerate(keys):
+        stored_n = stored_positions.get(key)
+        stored_predecessor = store['revisions'][stored_n - 1] if stored_n else None
+        predecessor = keys[n - 1] if n else None
+        if stored_n is not None and stored_predecessor == predecessor:
+            refreshed['timeslices'].append(store['timeslices'][stored_n])
+            refreshed['digests'].append(store['digests'][stored_n])
+            refreshed['diagram_found'].append(store['diagram_found'][stored_n])
+            continue
+
+        parsed = parser.parse_models(mdj_array = [mdjs[n]])
+        if not parsed:
+            return None, True
+        prev_timeslice = refreshed['timeslices'][-1] if n else None
+        timeslice, diagram_found, error_flag = anal.get_timeslice(parsed[0], diagram_id, prev_timeslice)
+        if error_flag:
+            return None, True
+        refreshed['timeslices'].append(timeslice)
+        refreshed['digests'].append(__timeslice_digest(timeslice))
+        refreshed['diagram_found'].append(diagram_found)
+
+    return refreshed, refreshed['digests'] != store['digests']
+
+
+def __remember_version(project_id, diagram_id, store):
+    """
+    Synopsis:
+        Remembers the cache version of a refreshed store for the revisions it was refreshed with.
+        Only versions of stores that are persisted are remembered, so unknown diagram IDs do not add entries.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    :param store: refreshed store of the diagram
+    """
+    with __versions_lock:
+        __versions[(project_id, diagram_id)] = (store['revisions'], __store_version(store), any(store['diagram_found']))
+
+
+def __get_store(project_id, diagram_id, mdjs):
+    """
+    Synopsis:
+        Returns the store of a diagram, refreshed for the given revisions of a project. The refreshed store is only
+        persisted if the diagram exists in the project, or if it holds the timeslices of all diagrams ('all').
+        This function claims the *store.lock* system lock of the project.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    :param mdjs: list of paths to the .mdj files of the project, as returned by the project_database
+    :returns store: refreshed store or None, if a revision could not be processed
+    :returns diagram_found: True, if at least one revision contains the diagram
+    """
+    folder = db.get_timeslice_store_folder(project_id)
+    path = os.path.join(folder, diagram_id + STORE_EXTENSION)
+    with open(os.path.join(folder, 'store.lock'), 'a', 0) as store_lock:
+        plocker.lock(store_lock, plocker.LOCK_EX)
+        stored = __load_store(path)
+        try:
+            store, changed = __refresh_store(stored, diagram_id, mdjs)
+        except OSError:
+            traceback.print_exc()
+            return None, False
+        if store is None:
+            return None, False
+
+        diagram_found = any(store['diagram_found'])
+        if (changed or store['revisions'] != stored['revisions']) and (diagram_found or diagram_id == 'all'):
+            __save_store(path, store)
+        if diagram_found or diagram_id == 'all':
+            __remember_version(project_id, diagram_id, store)
+        return store, diagram_found
+
+
+def get_timeslices(project_id, diagram_id, mdjs):
+    """
+    Synopsis:
+        Returns the timeslices of a diagram for the given revisions of a project. Timeslices are taken from
+        the store and only missing or outdated timeslices are computed, see __get_store.
+        This function claims the *store.lock* system lock of the project.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    :param mdjs: list of paths to the .mdj files of the project, as returned by the project_database
+    :returns timeslice_array: list of timeslices
+    :returns diagram_found: True, if at least one revision contains the diagram
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    store, diagram_found = __get_store(project_id, diagram_id, mdjs)
+    if store is None:
+        return [], False, True
+    return store['timeslices'], diagram_found, False
+
+
+def get_cache_version(project_id, diagram_id, mdjs):
+    """
+    Synopsis:
+        Identifies the frames of a diagram for the given revisions of a project, so that outdated caches are
+        never read and need not be removed before rendering. The version only changes if the timeslices of
+        the diagram change, and is remembered per process, so the store is only read if the revisions changed.
+        This function claims the *store.lock* system lock of the project, unless the version is remembered.
+    :param project_id: ID of the project
+    :param diagram_id: ID of the diagram
+    :param mdjs: list of paths to the .mdj files of the project, as returned by the project_database
+    :returns version: string
+    :returns diagram_found: True, if at least one revision contains the diagram
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    try:
+        keys = [__revision_key(mdj) for mdj in mdjs]
+    except OSError:
+        traceback.print_exc()
+        return None, False, True
+    with __versions_lock:
+        remembered = __versions.get((project_id, diagram_id))
+    if remembered is not None and remembered[0] == keys:
+        return remembered[1], remembered[2], False
+
+    store, diagram_found = __get_store(project_id, diagram_id, mdjs)
+    if store is None:
+        return None, False, True
+    return __store_version(store), diagram_found, False
+
+
+def update_project(project_id):
+    """
+    Synopsis:
+        Brings all stored diagrams of a project up to date with its revisions. Call this after a revision
+        has been added to or removed from the project.
+        This function claims the *db.lock* system lock and the *store.lock* system lock of the project.
+    :param project_id: ID of the project
+    :returns changed_diagrams: list of IDs of the diagrams whose timeslices changed, see __refresh_store
+    """
+    mdjs = db.get_project_models(project_id = project_id)
+    folder = db.get_timeslice_store_folder(project_id)
+    changed_diagrams = list()
+    with open(os.path.join(folder, 'store.lock'), 'a', 0) as store_lock:
+        plocker.lock(store_lock, plocker.LOCK_EX)
+        for file_name in os.listdir(folder):
+            if not file_name.endswith(STORE_EXTENSION):
+                continue
+            diagram_id = file_name[:-len(STORE_EXTENSION)]
+            path = os.path.join(folder, file_name)
+            stored = __load_store(path)
+            try:
+                store, changed = __refresh_store(stored, diagram_id, mdjs)
+            except OSError:
+                traceback.print_exc()
+                store, changed = None, True
+            if store is None:
+                os.remove(path)
+            else:
+                if changed or store['revisions'] != stored['revisions']:
+                    __save_store(path, store)
+                __remember_version(project_id, diagram_id, store)
+            if changed:
+                changed_diagrams.append(diagram_id)
+    return changed_diagrams
+
+
+def warm_project(project_id, mdjs):
+    """
+    Synopsis:
+        Computes the timeslices of all diagrams of a project at once, walking every revision only once, and
+        persists the stores of all diagrams that are not stored for the given revisions yet.
+        This function claims the *store.lock* system lock of the project.
+    :param project_id: ID of the project
+    :param mdjs: list of paths to the .mdj files of the project, as returned by the project_database
+    :returns timeslice_arrays: dictionary of diagram IDs and their lists of timeslices, including 'all'
+    :returns error_flag: indicator that an error occurred during execution
+    """
+    folder = db.get_timeslice_store_folder(project_id)
+    with open(os.path.join(folder, 'store.lock'), 'a', 0) as store_lock:
+        plocker.lock(store_lock, plocker.LOCK_EX)
+        try:
+            keys = [__revision_key(mdj) for mdj in mdjs]
+        except OSError:
+            traceback.print_exc()
+            return {'all': list()}, True
+
+        parsed = parser.parse_models(mdj_array = mdjs)
+        if len(parsed) != len(mdjs):
+            return {'all': list()}, True
+        timeslice_arrays, diagram_revisions, error_flag = anal.get_timeslices_per_diagram(parsed)
+        if error_flag:
+            return timeslice_arrays, True
+
+        for diagram_id, found in diagram_revisions.iteritems():
+            path = os.path.join(folder, diagram_id + STORE_EXTENSION)
+            if __load_store(path)['revisions'] == keys:
+                continue
+            __save_store(path, __new_store(keys, timeslice_arrays[diagram_id], found))
+        return timeslice_arrays, False
@@ -0,0 +1,215 @@
+# coding=utf-8
+
+"""
+Copyright (c) 2016, 2017 FZI Forschungszentrum Informatik am Karlsruher Institut für Technologie
+
+This file is part of SNAPE.
+
+SNAPE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+SNAPE is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with SNAPE.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+The token store keeps the user tokens of all projects in a SQLite file, indexed by token, so validating a token
+does not load the tokens of all projects and adding or removing tokens does not rewrite them.
+Validated tokens are additionally kept in a process-local read cache, which is cleared whenever the store is
+written, by this or any other process.
+The store replaces the *token_list* shelve of former versions, which is migrated on first use.
+"""
+
+import os
+import shelve
+import sqlite3
+import struct
+import threading
+import whichdb
+from contextlib import closing
+from security import generate_token
+
+TOKEN_FILE = 'tokens.sqlite'
+SHELVE_FILE = 'token_list'  # token store of former versions
+CHANGE_COUNTER_OFFSET = 24  # position of the file change counter in the header of a SQLite database file
+
+__SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tokens_by_project ON tokens (project_id);
+'''
+
+__cache = dict()  # token -> project ID of tokens that were found valid
+__cache_stamp = None  # state of the token file the cache belongs to
+__cache_lock = threading.Lock()
+
+
+def __connect():
+    """
+    Synopsis:
+        Opens a connection to the token store. If the store does not exist yet, it is created
+        and the tokens of the *token_list* shelve of former versions are migrated into it.
+        Used as context manager, a connection commits on success and rolls back on errors.
+    :returns connection: sqlite3 connection
+    """
+    if not os.path.isfile(TOKEN_FILE):
+        migrate_shelve()
+    return sqlite3.connect(TOKEN_FILE, timeout = 30)
+
+
+def __file_stamp():
+    """
+    Synopsis:
+        Returns a stamp of the token file that changes whenever the store is written.
+        SQLite increments the file change counter in the header of the file with every write transaction
+        (the store does not use a write-ahead log, which would leave the counter untouched), so unlike
+        the size and modification time of the file the stamp also changes if a token is replaced
+        within the same second.
+    :returns stamp: (inode, file change counter) tuple, or None if the store does not exist
+    """
+    try:
+        with open(TOKEN_FILE, 'rb') as token_file:
+            inode = os.fstat(token_file.fileno()).st_ino
+            token_file.seek(CHANGE_COUNTER_OFFSET)
+            header = token_file.read(4)
+    except (IOError, OSError):
+        return None
+    if len(header) != 4:
+        return None
+    return inode, struct.unpack('>I', header)[0]
+
+
+def __clear_cache():
+    """
+    Synopsis:
+        Empties the read cache. Called after every write to the store.
+    """
+    global __cache_stamp
+    with __cache_lock:
+        __cache.clear()
+        __cache_stamp = None
+
+
+def migrate_shelve():
+    """
+    Synopsis:
+        Creates the token store from the *token_list* shelve of former versions, or empty if there is none.
+        The store is written to a temporary file first and then moved into place, so concurrent processes
+        either see no store or the complete one. The shelve is left untouched.
+    """
+    rows = list()
+    if whichdb.whichdb(SHELVE_FILE):
+        token_file = shelve.open(SHELVE_FILE, 'r')
+        try:
+            for key in token_file.keys():
+                if key != 'token_list':  # the list of all tokens is redundant
+                    rows.extend((unicode(token), unicode(key)) for token in token_file[key])
+        finally:
+            token_file.close()
+
+    temp_file = '%s.%i.tmp' % (TOKEN_FILE, os.getpid())
+    with closing(sqlite3.connect(temp_file)) as connection:
+        with connection:
+            connection.executescript(__SCHEMA)
+            connection.executemany('INSERT OR IGNORE INTO tokens VALUES (?, ?)', rows)
+    try:
+        os.link(temp_file, TOKEN_FILE)  # unlike a rename, this never replaces a store created in the meantime
+    except OSError:
+        if not os.path.isfile(TOKEN_FILE):
+            raise
+    finally:
+        os.remove(temp_file)
+
+
+def token_is_valid(project_id, token):
+    """
+    Synopsis:
+        Checks if a user submitted token is valid for a given project.
+    :param project_id: ID of the project for which validation is checked
+    :param token: token for which the access rights are checked
+    :returns valid: boolean
+    """
+    global __cache_stamp
+    project_id = unicode(project_id)
+    stamp = __file_stamp()
+    with __cache_lock:
+        if stamp != __cache_stamp:
+            __cache.clear()
+            __cache_stamp = stamp
+        if stamp is not None and __cache.get(token) == project_id:
+            return True
+
+    try:
+        with closing(__connect()) as connection:
+            row = connection.execute('SELECT project_id FROM tokens WHERE token = ?', (unicode(token),)).fetchone()
+    except (sqlite3.Error, UnicodeDecodeError):
+        return False
+    if row is None or row[0] != project_id:
+        return False
+
+    with __cache_lock:
+        if __cache_stamp == stamp:
+            __cache[token] = project_id
+    return True
+
+
+def add_tokens(project_id, count):
+    """
+    Synopsis:
+        Generates new unique user tokens for a project and adds them to the store.
+    :param project_id: ID of the project
+    :param count: number of tokens to be generated
+    :returns new_tokens: list of strings
+    """
+    new_tokens = list()
+    try:
+        with closing(__connect()) as connection:
+            while len(new_tokens) < count:
+                token = generate_token()
+                with connection:
+                    inserted = connection.execute('INSERT OR IGNORE INTO tokens VALUES (?, ?)',
+                                                  (unicode(token), unicode(project_id))).rowcount
+                if inserted:  # else the token is already in use
+                    new_tokens.append(token)
+    finally:
+        __clear_cache()
+    return new_tokens
+
+
+def remove_tokens(project_id, tokens):
+    """
+    Synopsis:
+        Removes the given tokens of a project from the store. Tokens of other projects are not affected.
+    :param project_id: ID of the project
+    :param tokens: list of tokens to be removed
+    """
+    try:
+        with closing(__connect()) as connection:
+            with connection:
+                connection.executemany('DELETE FROM tokens WHERE token = ? AND project_id = ?',
+                                       [(unicode(token), unicode(project_id)) for token in tokens])
+    finally:
+        __clear_cache()
+
+
+def remove_project(project_id):
+    """
+    Synopsis:
+        Removes all tokens of a project from the store.
+    :param project_id: ID of the project
+    """
+    try:
+        with closing(__connect()) as connection:
+            with connection:
+                connection.execute('DELETE FROM tokens WHERE project_id = ?', (unicode(project_id),))
+    finally:
+        __clear_cache()